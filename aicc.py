@@ -1,11 +1,26 @@
 import argparse
 import datetime
 import os
+import re
 import ast
 import io
 import sys
+import gzip
+import json
+import time
+import hashlib
+import functools
+import collections
+import math
+import random
+import contextlib
+import concurrent.futures
 import tokenize
 import logging
+import logging.handlers
+import queue
+import multiprocessing
+import stat
 from pathlib import Path
 import yaml
 import pathspec
@@ -17,6 +32,12 @@ try:
 except ImportError:
     TIKTOKEN_AVAILABLE = False
 
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
 # --- Fonctions de traitement des fichiers ---
 
 # CORRIGÉ : Nouvelle version robuste utilisant 'ast'
@@ -116,94 +137,370 @@ def get_python_headers(content, full_body_filters_patterns):
 
 # --- Fonctions utilitaires ---
 
+_log_listener = None
+
 def setup_logging(log_file_path, verbose):
+    """
+    Configure le logging : les appels ne font que déposer l'enregistrement dans une file,
+    un thread d'arrière-plan (QueueListener) se charge du formatage et de l'écriture.
+    Sans --verbose, les détails par fichier (niveau DEBUG) ne sont même pas formatés.
+    """
+    global _log_listener
+    stop_logging()
     log_file_path.parent.mkdir(parents=True, exist_ok=True)
     # Correction pour éviter les handlers dupliqués si la fonction est appelée plusieurs fois
     logger = logging.getLogger()
-    if logger.hasHandlers():
-        logger.handlers.clear()
-    logger.setLevel(logging.INFO)
+    # Fermeture explicite : en mode batch, un même processus enchaîne plusieurs projets.
+    for handler in logger.handlers[:]:
+        handler.close()
+        logger.removeHandler(handler)
+    level = logging.DEBUG if verbose else logging.INFO
+    logger.setLevel(level)
     file_handler = logging.FileHandler(log_file_path, mode='w', encoding='utf-8')
-    file_handler.setLevel(logging.INFO)
+    file_handler.setLevel(level)
     file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO if verbose else logging.WARNING)
+    console_handler.setLevel(logging.DEBUG if verbose else logging.WARNING)
     console_formatter = logging.Formatter('%(message)s')
     console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _log_listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _log_listener.start()
 
-# <<< MODIFICATION : La fonction generate_tree est maintenant optimisée avec os.walk pour élaguer les dossiers exclus.
-def generate_tree(directory, include_spec, exclude_spec, show_sizes=False):
-    tree_lines = [f"Arbre du projet : {directory.resolve()}"]
-    
-    paths_for_tree = set()
+def stop_logging():
+    """Vide la file de logs, arrête le thread d'écriture et ferme le fichier de log."""
+    global _log_listener
+    if _log_listener is None:
+        return
+    _log_listener.stop()
+    for handler in _log_listener.handlers:
+        handler.close()
+    _log_listener = None
 
-    for root, dirs, files in os.walk(directory, topdown=True):
-        root_path = Path(root)
-        
-        # Logique d'élagage : on retire de la liste `dirs` les dossiers à exclure
-        # pour que os.walk ne les visite pas.
-        excluded_dirs = []
-        for d in dirs:
-            dir_path_str = str((root_path / d).relative_to(directory)).replace('\\', '/')
-            if exclude_spec.match_file(dir_path_str) or exclude_spec.match_file(dir_path_str + '/'):
-                excluded_dirs.append(d)
-        
-        for d in excluded_dirs:
-            dirs.remove(d)
+@contextlib.contextmanager
+def forward_worker_logs():
+    """
+    Relaye vers les handlers du processus principal les logs émis par les processus
+    de travail (voir init_worker_logging). Produit la file à transmettre au pool.
+    """
+    log_queue = multiprocessing.Queue()
+    listener = None
+    if _log_listener is not None:
+        listener = logging.handlers.QueueListener(log_queue, *_log_listener.handlers, respect_handler_level=True)
+        listener.start()
+    try:
+        yield log_queue
+    finally:
+        if listener is not None:
+            listener.stop()
+        log_queue.close()
+
+def init_worker_logging(log_queue, level):
+    """Initialiseur de pool : les logs du processus de travail partent dans la file du processus principal."""
+    logger = logging.getLogger()
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(level)
+
+class ProgressTracker:
+    """
+    Compteurs de progression (fichiers, octets, tokens). Un résumé est journalisé à
+    intervalle régulier au lieu d'une ligne par fichier, et, sur un terminal, une
+    ligne de progression est rafraîchie sur stderr. Un débit en tokens est marqué
+    '~' s'il inclut des estimations (tiktoken indisponible).
+    """
+    def __init__(self, total_files, interval=2.0, show=None):
+        self.total_files = total_files
+        self.interval = interval
+        self.show = sys.stderr.isatty() if show is None else show
+        self.files = 0
+        self.bytes = 0
+        self.tokens = 0
+        self.estimated = False
+        self.started = time.monotonic()
+        self.next_report = self.started + interval
 
-        # On traite les dossiers et fichiers restants
-        for name in dirs + files:
-            item_path = root_path / name
-            relative_p_str = str(item_path.relative_to(directory)).replace('\\', '/')
-            if include_spec.match_file(relative_p_str) and not exclude_spec.match_file(relative_p_str):
-                paths_for_tree.add(item_path)
+    def update(self, n_bytes, tokens=None, estimated=False):
+        self.files += 1
+        self.bytes += n_bytes
+        if isinstance(tokens, int):
+            self.tokens += tokens
+            self.estimated = self.estimated or estimated
+        now = time.monotonic()
+        if now >= self.next_report:
+            self.next_report = now + self.interval
+            self.report()
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rates = f"{self.files / elapsed:.0f} fichiers/s, {self.bytes / elapsed / (1024 * 1024):.2f} Mo/s"
+        if self.tokens:
+            rates += f", {'~' if self.estimated else ''}{self.tokens / elapsed:.0f} tokens/s"
+        return f"{self.files}/{self.total_files} fichiers, {format_bytes(self.bytes)} en {elapsed:.1f} s ({rates})"
+
+    def report(self, final=False):
+        line = self.summary()
+        logging.info(f"{'Traitement terminé' if final else 'Progression'} : {line}")
+        if self.show:
+            sys.stderr.write(f"\r{line}" + ("\n" if final else ""))
+            sys.stderr.flush()
+
+# --- Parcours du projet et index de scan persistant ---
+
+SCAN_INDEX_VERSION = 2
+SCAN_CACHE_DIRNAME = '.aicc_cache'
+
+def list_directory(dir_path):
+    """
+    Liste un dossier : sous-dossiers, fichiers réguliers, liens symboliques vers des
+    dossiers, et fichiers spéciaux (FIFO, sockets, périphériques, liens cassés).
+    Le type vient de scandir (sans appel stat supplémentaire, sauf pour les liens) :
+    les fichiers spéciaux sont écartés dès le scan, leur lecture pourrait bloquer.
+    """
+    dirs, files, dir_links, special = [], [], [], []
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    is_file = not is_dir and entry.is_file()
+                except OSError:
+                    is_dir = is_file = False
+                if is_dir:
+                    dirs.append(entry.name)
+                    if entry.is_symlink():
+                        dir_links.append(entry.name)
+                elif is_file:
+                    files.append(entry.name)
+                else:
+                    special.append(entry.name)
+    except OSError:
+        # Comme os.walk : un dossier illisible est simplement ignoré.
+        pass
+    return {'dirs': sorted(dirs), 'files': sorted(files), 'dir_links': dir_links, 'special': sorted(special)}
+
+def compute_verdicts(rel_dir, entry, include_spec, exclude_spec, follow_symlinks=False):
+    """
+    Applique les filtres aux enfants d'un dossier.
+    'walk' : sous-dossiers à parcourir (non élagués), 'dirs'/'files' : éléments retenus.
+    """
+    prefix = f"{rel_dir}/" if rel_dir else ""
+    walk, matched_dirs, matched_files = [], [], []
+    for d in entry['dirs']:
+        rel = prefix + d
+        if exclude_spec.match_file(rel) or exclude_spec.match_file(rel + '/'):
+            continue
+        # Sauf avec follow_symlinks, les liens vers des dossiers sont affichés mais pas parcourus.
+        if follow_symlinks or d not in entry['dir_links']:
+            walk.append(d)
+        if include_spec.match_file(rel):
+            matched_dirs.append(d)
+    for name in entry['files']:
+        rel = prefix + name
+        if include_spec.match_file(rel) and not exclude_spec.match_file(rel):
+            matched_files.append(name)
+    return {'walk': walk, 'dirs': matched_dirs, 'files': matched_files}
+
+def compute_filters_key(project_path, *pattern_lists):
+    """Empreinte de l'ensemble effectif des filtres (et du projet) servant de clé à l'index."""
+    payload = json.dumps([str(project_path)] + [list(p) for p in pattern_lists], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def read_json_index(path, version):
+    """Contenu d'un index JSON de cache, ou None s'il est absent, illisible ou d'une autre version."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) and data.get('version') == version else None
+
+def write_json_atomic(path, payload):
+    """
+    Écrit un index JSON de cache de façon atomique. Le fichier temporaire est propre
+    au processus : en batch, deux entrées du manifeste pour le même projet peuvent
+    écrire le même index en parallèle (le dernier l'emporte). Un cache est facultatif :
+    une erreur d'écriture (disque plein, dossier en lecture seule) est signalée sans
+    interrompre l'exécution. Retourne True si l'index a été écrit.
+    """
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(payload, ensure_ascii=False, separators=(',', ':')))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"  -> AVERTISSEMENT: Index de cache '{path}' non écrit ({e}).")
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        return False
+    return True
+
+class ScanIndex:
+    """
+    Index du parcours : pour chaque dossier, son mtime, ses enfants et les verdicts
+    des filtres par section ('tree', 'content'). Seuls les dossiers dont le mtime a
+    changé sont relistés. Sans chemin, l'index n'est pas persisté mais évite quand
+    même de lister deux fois les dossiers communs à l'arbre et au contenu.
+    """
+    # Un dossier modifié juste avant le scan pourrait l'être encore dans la même
+    # unité de mtime : son entrée n'est pas persistée pour éviter un faux « inchangé ».
+    RACY_WINDOW_NS = 2_000_000_000
+
+    def __init__(self, path=None, key=None):
+        self.path = path
+        self.key = key
+        self.entries = {}
+        self.visited = {}
+        self.relisted = 0
+        self.dirty = False
+        self.started_ns = time.time_ns()
+
+    @classmethod
+    def load(cls, path, key):
+        index = cls(path, key)
+        data = read_json_index(path, SCAN_INDEX_VERSION)
+        if data is not None and data.get('key') == key:
+            index.entries = data.get('dirs', {})
+        return index
+
+    def get(self, rel_dir, dir_path):
+        """
+        Retourne l'entrée du dossier, relistée seulement si son mtime ou son identité
+        (st_dev, st_ino : la cible d'un lien symbolique peut changer) a changé.
+        """
+        entry = self.visited.get(rel_dir)
+        if entry is not None:
+            return entry
+        try:
+            st = os.stat(dir_path)
+            mtime, dir_id = st.st_mtime_ns, [st.st_dev, st.st_ino]
+        except OSError:
+            mtime, dir_id = None, None
+        entry = self.entries.get(rel_dir)
+        if entry is None or mtime is None or entry['mtime'] != mtime or entry.get('id') != dir_id:
+            entry = {'mtime': mtime, 'id': dir_id, **list_directory(dir_path)}
+            self.relisted += 1
+            self.dirty = True
+        self.visited[rel_dir] = entry
+        return entry
+
+    def save(self):
+        # Rien à réécrire si aucun dossier n'a été relisté, filtré ou supprimé.
+        if self.path is None or (not self.dirty and self.visited.keys() == self.entries.keys()):
+            return
+        limit = self.started_ns - self.RACY_WINDOW_NS
+        dirs = {rel: entry for rel, entry in self.visited.items() if entry['mtime'] is not None and entry['mtime'] < limit}
+        write_json_atomic(self.path, {'version': SCAN_INDEX_VERSION, 'key': self.key, 'dirs': dirs})
+
+def walk_filtered(directory, include_spec, exclude_spec, section, scan_index=None, follow_symlinks=False):
+    """
+    Parcourt `directory` en élaguant les dossiers exclus.
+    Produit, pour chaque dossier visité, (chemin, chemin relatif, sous-dossiers retenus, fichiers retenus).
+    Un dossier déjà visité (même st_dev, st_ino), atteint par un lien symbolique, n'est
+    pas reparcouru : pas de boucle ni de doublon avec follow_symlinks. Les liens ne sont
+    parcourus qu'après toute l'arborescence réelle (puis dans l'ordre de tri) : un dossier
+    du projet atteignable des deux façons garde toujours son chemin réel.
+    """
+    if scan_index is None:
+        scan_index = ScanIndex()
+    pending, links = [''], []
+    visited_ids = set()
+    while pending or links:
+        if not pending:
+            links.sort(key=path_sort_key, reverse=True)
+            pending.append(links.pop())
+        rel_dir = pending.pop()
+        dir_path = directory / rel_dir if rel_dir else directory
+        entry = scan_index.get(rel_dir, dir_path)
+        if entry['id'] is not None:
+            dir_id = tuple(entry['id'])
+            if dir_id in visited_ids:
+                logging.debug(f"  [DÉJÀ PARCOURU] {rel_dir} (lien symbolique vers un dossier déjà visité)")
+                continue
+            visited_ids.add(dir_id)
+        verdicts = entry.get(section)
+        if verdicts is None:
+            verdicts = entry[section] = compute_verdicts(rel_dir, entry, include_spec, exclude_spec, follow_symlinks)
+            scan_index.dirty = True
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        for d in verdicts['walk']:
+            (links if d in entry['dir_links'] else pending).append(prefix + d)
+        yield dir_path, rel_dir, verdicts['dirs'], verdicts['files']
+
+def path_sort_key(relative_path):
+    """Clé de tri d'un chemin relatif ('a/b.py'), identique à l'ordre des objets Path."""
+    parts = relative_path.split('/')
+    return [p.lower() for p in parts] if os.name == 'nt' else parts
+
+def collect_tree_paths(directory, include_spec, exclude_spec, scan_index=None, follow_symlinks=False):
+    """Retourne les chemins relatifs visibles dans l'arbre, triés, et l'ensemble de ceux qui sont des dossiers."""
+    # Les chemins sont manipulés sous forme relative ('app/main.py') : bien moins
+    # coûteux que des objets Path sur des arbres de plusieurs centaines de milliers d'entrées.
+    paths_for_tree = set()
+    dir_paths = set()
+
+    for _, rel_dir, matched_dirs, matched_files in walk_filtered(directory, include_spec, exclude_spec, 'tree', scan_index, follow_symlinks):
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        for name in matched_dirs:
+            dir_paths.add(prefix + name)
+            paths_for_tree.add(prefix + name)
+        for name in matched_files:
+            paths_for_tree.add(prefix + name)
 
     # Assurer que les dossiers parents des chemins visibles sont inclus
     final_paths_for_tree = set(paths_for_tree)
+    added_parents = set()
     for path in paths_for_tree:
-        parent = path.parent
-        while parent and parent != directory:
+        parent = path.rpartition('/')[0]
+        while parent and parent not in added_parents:
+            added_parents.add(parent)
             final_paths_for_tree.add(parent)
-            parent = parent.parent
+            dir_paths.add(parent)
+            parent = parent.rpartition('/')[0]
 
-    # Trier et dessiner l'arbre
-    paths = sorted(list(final_paths_for_tree))
+    # Trier l'arbre
+    return sorted(final_paths_for_tree, key=path_sort_key), dir_paths
+
+def render_tree(directory, paths, dir_paths, show_sizes=False):
+    tree_lines = [f"Arbre du projet : {directory.resolve()}"]
+
+    # Les chemins étant triés, le dernier vu pour un parent est son dernier enfant affiché.
+    last_child = {path.rpartition('/')[0]: path for path in paths}
     
     last_in_level = {}
     for path in paths:
-        if path == directory: continue # Ne pas dessiner la racine elle-même dans l'arbre
-        relative_path = path.relative_to(directory)
-        depth = len(relative_path.parts)
+        parent, _, name = path.rpartition('/')
+        depth = path.count('/') + 1
         
-        try:
-            siblings_in_tree = [p for p in sorted(path.parent.iterdir()) if p in final_paths_for_tree]
-            is_last = (path == siblings_in_tree[-1]) if siblings_in_tree else True
-        except (IndexError, FileNotFoundError):
-            is_last = True
+        is_last = last_child[parent] == path
         
         last_in_level[depth - 1] = is_last
         
         indent = "".join(["    " if last_in_level.get(i) else "│   " for i in range(depth - 1)])
         connector = "└── " if is_last else "├── "
         
-        if path.is_dir():
-            tree_lines.append(f"{indent}{connector}{path.name}/")
+        if path in dir_paths:
+            tree_lines.append(f"{indent}{connector}{name}/")
         else:
             if show_sizes:
                 try:
                     # Calcul de la taille en Ko
-                    size_kb = path.stat().st_size / 1024.0
-                    tree_lines.append(f"{indent}{connector}{path.name} ({size_kb:.2f} KB)")
+                    size_kb = os.stat(directory / path).st_size / 1024.0
+                    tree_lines.append(f"{indent}{connector}{name} ({size_kb:.2f} KB)")
                 except OSError:
-                    tree_lines.append(f"{indent}{connector}{path.name} (taille inconnue)")
+                    tree_lines.append(f"{indent}{connector}{name} (taille inconnue)")
             else:
-                tree_lines.append(f"{indent}{connector}{path.name}")
+                tree_lines.append(f"{indent}{connector}{name}")
 
     return "\n".join(tree_lines)
-# <<< FIN MODIFICATION
+
+def generate_tree(directory, include_spec, exclude_spec, show_sizes=False, scan_index=None, follow_symlinks=False):
+    paths, dir_paths = collect_tree_paths(directory, include_spec, exclude_spec, scan_index, follow_symlinks)
+    return render_tree(directory, paths, dir_paths, show_sizes)
 
 def format_bytes(size):
     if size < 1024: return f"{size} B"
@@ -212,25 +509,947 @@ def format_bytes(size):
         if size < 1024.0: return f"{size:.2f} {unit}"
     return f"{size:.2f} PB"
 
+@functools.lru_cache(maxsize=None)
+def load_tiktoken_encoding():
+    """Charge l'encodeur tiktoken une seule fois (l'échec éventuel est aussi mis en cache)."""
+    try:
+        return tiktoken.get_encoding("cl100k_base"), None
+    except Exception as e:
+        # AJOUT : Affiche l'erreur réelle dans la console pour comprendre
+        logging.error(f"Erreur Tiktoken : {e}")
+        return None, e
+
+def count_tokens(content_str):
+    if not TIKTOKEN_AVAILABLE:
+        return "N/A"
+    encoding_tiktoken, error = load_tiktoken_encoding()
+    if error is not None:
+        return "Erreur"
+    return len(encoding_tiktoken.encode(content_str, disallowed_special=()))
+
+def format_stats(total_bytes, tokens):
+    return f"Taille: {format_bytes(total_bytes)} ({total_bytes:,} octets), Tokens (estim.): {tokens}"
+
 def get_file_stats(content_str, encoding='utf-8'):
-    total_bytes = len(content_str.encode(encoding))
-    formatted_size = format_bytes(total_bytes)
-    tokens = "N/A"
-    if TIKTOKEN_AVAILABLE:
+    return format_stats(len(content_str.encode(encoding)), count_tokens(content_str))
+
+def approximate_tokens(content_str):
+    """Estimation sans tokenisation (~4 caractères par token)."""
+    return len(content_str) // 4 + 1
+
+def estimate_tokens(content_str):
+    """Compte exact si tiktoken est utilisable, sinon estimation (~4 caractères par token)."""
+    tokens = count_tokens(content_str)
+    return tokens if isinstance(tokens, int) else approximate_tokens(content_str)
+
+# --- Traitement du contenu ---
+
+def get_processing_mode(file_path, args):
+    """Retourne le mode de traitement d'un fichier : 'headers', 'strip' ou 'full'."""
+    if args.headers_only and file_path.suffix == '.py':
+        return 'headers'
+    if args.strip_comments:
+        return 'strip'
+    return 'full'
+
+def transform_content(content, file_path, mode, full_body_filters):
+    if mode == 'headers':
+        return get_python_headers(content, full_body_filters)
+    if mode == 'strip':
+        return strip_comments_from_code(content, file_path)
+    return content
+
+TRANSFORM_CACHE_VERSION = 1
+
+# Taille maximale par défaut du cache de transformations (clé de configuration transform_cache_max_mb).
+TRANSFORM_CACHE_MAX_MB = 256
+# Une entrée lue n'est rafraîchie (mtime) qu'une fois par intervalle : l'ordre LRU
+# de prune() reste juste à la journée près, sans un utime par fichier à chaque run.
+TRANSFORM_CACHE_TOUCH_INTERVAL = 24 * 3600
+# Témoin déposé à la racine du cache par toute écriture : prune() ne parcourt le
+# cache que s'il a grossi depuis le dernier élagage.
+TRANSFORM_CACHE_PRUNE_MARKER = 'prune-pending'
+
+class TransformCache:
+    """
+    Cache disque des contenus transformés ('strip', 'headers'), adressé par l'empreinte
+    du contenu source, du mode et des filtres : il peut être partagé entre projets et
+    entre processus (écritures atomiques). Le dossier peut être supprimé à tout moment.
+    Chaque modification d'un source crée une nouvelle entrée : prune() borne la taille
+    du cache en supprimant les entrées les moins récemment utilisées (mtime), et seulement
+    si une écriture a eu lieu depuis le dernier élagage.
+    En lecture seule (--dry-run), le cache est consulté mais jamais modifié.
+    """
+    def __init__(self, directory, read_only=False):
+        self.directory = Path(directory)
+        self.read_only = read_only
+        self.marked = False
+
+    def key(self, content, file_path, mode, full_body_filters):
+        file_path = Path(file_path)
+        # strip_comments_from_code dépend de l'extension (et du nom pour les Dockerfile),
+        # ast.unparse de la version de Python.
+        salt = [TRANSFORM_CACHE_VERSION, sys.version_info[:2], mode, file_path.suffix,
+                'Dockerfile' in file_path.name, list(full_body_filters)]
+        digest = hashlib.sha256(json.dumps(salt).encode('utf-8'))
+        digest.update(content.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def transform(self, content, file_path, mode, full_body_filters):
+        if mode == 'full':
+            return content
+        key = self.key(content, file_path, mode, full_body_filters)
+        cache_path = self.directory / key[:2] / key
+        try:
+            with open(cache_path, 'r', encoding='utf-8', newline='') as f:
+                cached = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+            if not self.read_only and time.time() - mtime > TRANSFORM_CACHE_TOUCH_INTERVAL:
+                # Le mtime tient lieu de date de dernière utilisation pour prune().
+                os.utime(cache_path)
+            return cached
+        except OSError:
+            pass
+        transformed = transform_content(content, file_path, mode, full_body_filters)
+        if self.read_only:
+            return transformed
         try:
-            encoding_tiktoken = tiktoken.get_encoding("cl100k_base")
-            tokens = len(encoding_tiktoken.encode(content_str))
-        except Exception as e:
-            # AJOUT : Affiche l'erreur réelle dans la console pour comprendre
-            logging.error(f"Erreur Tiktoken : {e}") 
-            tokens = "Erreur"
-    return f"Taille: {formatted_size} ({total_bytes:,} octets), Tokens (estim.): {tokens}"
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f"{key}.{os.getpid()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8', newline='', errors='surrogatepass') as f:
+                f.write(transformed)
+            os.replace(tmp_path, cache_path)
+            if not self.marked:
+                (self.directory / TRANSFORM_CACHE_PRUNE_MARKER).touch()
+                self.marked = True
+        except OSError as e:
+            logging.warning(f"  -> AVERTISSEMENT: Cache de transformation non écrit ({e}).")
+        return transformed
 
-# --- Fonction principale ---
+    def prune(self, max_bytes):
+        """
+        Supprime les entrées les moins récemment utilisées jusqu'à repasser sous `max_bytes`,
+        ainsi que les fichiers temporaires abandonnés. Sans écriture depuis le dernier élagage,
+        le cache n'est pas parcouru. Retourne (fichiers supprimés, octets libérés).
+        """
+        entries, total = [], 0
+        stale_limit = time.time() - 3600
+        removed = freed = 0
+        try:
+            # Retiré avant le parcours : une écriture concurrente le redépose pour le run suivant.
+            os.remove(self.directory / TRANSFORM_CACHE_PRUNE_MARKER)
+        except FileNotFoundError:
+            return 0, 0
+        except OSError:
+            pass
+        try:
+            shards = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        except OSError:
+            return 0, 0
+        for shard in shards:
+            try:
+                with os.scandir(shard) as it:
+                    for entry in it:
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        if entry.name.endswith('.tmp'):
+                            if st.st_mtime < stale_limit:
+                                with contextlib.suppress(OSError):
+                                    os.remove(entry.path)
+                            continue
+                        entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                        total += st.st_size
+            except OSError:
+                continue
+        if total <= max_bytes:
+            return 0, 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+def prune_transform_cache(directory, max_mb):
+    """Borne la taille du cache de transformations et journalise les suppressions."""
+    max_mb = TRANSFORM_CACHE_MAX_MB if max_mb is None else max_mb
+    removed, freed = TransformCache(directory).prune(int(max_mb * 1024 * 1024))
+    if removed:
+        logging.info(f"Cache de transformations : {removed} entrée(s) ancienne(s) supprimée(s) ({format_bytes(freed)}), limite {max_mb} Mo.")
+    return removed, freed
+
+def read_and_transform(item, project_path, encoding, full_body_filters, transform_cache=None):
+    """
+    Lit et transforme un fichier (chemin relatif, mode) de la sélection.
+    Fonction de module pour pouvoir être exécutée dans un processus de travail.
+    Retourne (contenu, None) ou (None, message d'erreur).
+    """
+    relative_path, mode = item
+    file_path = project_path / relative_path
+    try:
+        with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
+            content = f.read()
+    except OSError as e:
+        return None, str(e)
+    if transform_cache is not None:
+        return transform_cache.transform(content, file_path, mode, full_body_filters), None
+    return transform_content(content, file_path, mode, full_body_filters), None
+
+# --- Découpage par symboles (gros fichiers Python) ---
+
+def split_source_lines(content):
+    """Lignes avec leur fin, découpées comme le fait ast (\n, \r\n ou \r seul)."""
+    return re.findall(r'.*?(?:\r\n|\r|\n)|.+\Z', content, re.S)
+
+def chunk_python_source(content):
+    """
+    Découpe un source Python selon les nœuds parcourus par get_python_headers() :
+    une section par fonction ou classe de premier niveau, et une par méthode
+    ('Classe.méthode'). Les lignes qui précèdent un nœud (commentaires, décorateurs)
+    lui sont rattachées ; le préambule et le code de module situé entre deux nœuds
+    forment des sections '<module>'. La concaténation des sections redonne le source.
+    Retourne [{'symbol', 'start', 'end', 'content'}] (lignes numérotées à partir de 1),
+    ou None si le source ne peut pas être analysé.
+    """
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return None
+    lines = split_source_lines(content)
+
+    def first_line(node):
+        return min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+
+    def has_code(start, end):
+        return any(line.strip() and not line.lstrip().startswith('#') for line in lines[start - 1:end - 1])
+
+    boundaries, previous_end = [], 0
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start, gap_start = first_line(node), previous_end + 1
+        if has_code(gap_start, start):
+            boundaries.append((gap_start, '<module>'))
+            gap_start = start
+        boundaries.append((gap_start, node.name))
+        if isinstance(node, ast.ClassDef):
+            for method_node in node.body:
+                if isinstance(method_node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    boundaries.append((first_line(method_node), f"{node.name}.{method_node.name}"))
+        previous_end = node.end_lineno
+    if has_code(previous_end + 1, len(lines) + 1):
+        boundaries.append((previous_end + 1, '<module>'))
+    if not boundaries:
+        return None
+
+    sections, seen = [], collections.Counter()
+    for i, (start, symbol) in enumerate(boundaries):
+        end = boundaries[i + 1][0] - 1 if i + 1 < len(boundaries) else len(lines)
+        # Un nom redéfini (ou plusieurs blocs '<module>') reste unique : 'nom#2', 'nom#3'...
+        seen[symbol] += 1
+        if seen[symbol] > 1:
+            symbol = f"{symbol}#{seen[symbol]}"
+        sections.append({'symbol': symbol, 'start': start, 'end': end, 'content': "".join(lines[start - 1:end])})
+    return sections
+
+def split_sections(relative_path, mode, content, chunk_lines):
+    """Sections d'un fichier Python dépassant `chunk_lines` lignes (None sinon, ou si le découpage échoue)."""
+    if not chunk_lines or mode == 'headers' or not relative_path.endswith('.py'):
+        return None
+    if len(split_source_lines(content)) <= chunk_lines:
+        return None
+    sections = chunk_python_source(content)
+    return sections if sections and len(sections) > 1 else None
+
+def section_records(relative_path, mode, sections, encoding='utf-8', change=None, previous_sections=None):
+    """
+    Un enregistrement par section, chacune avec son propre compte de tokens.
+    En différentiel (fichier modifié), seules les sections dont l'empreinte a changé
+    sont émises, suivies d'un enregistrement vide par symbole supprimé.
+    """
+    if change != 'modified' or previous_sections is None:
+        return [file_record(relative_path, mode, section['content'], encoding, True, change, section) for section in sections]
+    records = []
+    for section in sections:
+        before = previous_sections.get(section['symbol'])
+        if before == content_digest(section['content']):
+            continue
+        records.append(file_record(relative_path, mode, section['content'], encoding, True,
+                                   'modified' if before is not None else 'added', section))
+    current = {section['symbol'] for section in sections}
+    records.extend(file_record(relative_path, mode, "", encoding, True, 'deleted', {'symbol': symbol})
+                   for symbol in previous_sections if symbol not in current)
+    return records
+
+# --- Formats de sortie ---
+
+OUTPUT_FORMATS = {'txt': '.txt', 'jsonl': '.jsonl', 'md': '.md'}
+OUTPUT_COMPRESSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+def open_output_stream(output_path, compression, encoding):
+    """Ouvre le flux texte de sortie, compressé à la volée si demandé."""
+    if compression == 'gzip':
+        return gzip.open(output_path, 'wt', encoding=encoding)
+    if compression == 'zstd':
+        raw = open(output_path, 'wb')
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw), encoding=encoding)
+    return open(output_path, 'w', encoding=encoding)
+
+def file_record(relative_path, mode, content, encoding='utf-8', with_tokens=True, change=None, section=None):
+    """
+    Construit l'enregistrement d'un fichier traité (partagé par tous les formats).
+    `change` ('added', 'modified' ou 'deleted') n'est renseigné qu'en sortie différentielle (--since).
+    `section` (issue de chunk_python_source) restreint l'enregistrement à un symbole du fichier.
+    """
+    record = {
+        'path': relative_path.replace('\\', '/'),
+        'mode': mode,
+        'bytes': len(content.encode(encoding)),
+        'tokens': count_tokens(content) if with_tokens else None,
+        'content': content,
+    }
+    if section is not None:
+        record['symbol'] = section['symbol']
+        record['lines'] = [section['start'], section['end']] if 'start' in section else None
+    if change is not None:
+        record['change'] = change
+    return record
+
+CHANGE_LABELS = {'added': 'ajouté', 'modified': 'modifié', 'deleted': 'supprimé'}
+
+def record_details(record):
+    """Complément du titre : symbole, lignes et tokens d'une section, nature du changement."""
+    details = ""
+    if record.get('symbol'):
+        details = f" :: {record['symbol']}"
+        notes = []
+        if record.get('lines'):
+            notes.append(f"lignes {record['lines'][0]}-{record['lines'][1]}")
+        if isinstance(record['tokens'], int) and record.get('change') != 'deleted':
+            notes.append(f"{record['tokens']} tokens")
+        if notes:
+            details += f" [{', '.join(notes)}]"
+    if record.get('change'):
+        details += f" ({CHANGE_LABELS[record['change']]})"
+    return details
+
+def record_title(record):
+    """Chemin du fichier, suivi du symbole et de la nature du changement le cas échéant."""
+    return record['path'] + record_details(record)
+
+class TextContextWriter:
+    """
+    Format texte historique (séparateurs '=' * 80).
+    Les statistiques globales figurant en tête du fichier, le corps est
+    conservé en mémoire et écrit d'un bloc à la fermeture.
+    """
+    # Le total est compté une fois sur le corps complet : pas de compte par fichier.
+    per_file_tokens = False
+
+    def __init__(self, stream, encoding='utf-8'):
+        self.stream = stream
+        self.encoding = encoding
+        self.tree = ""
+        self.chunks = []
+        self.stats = ""
+        self.files = 0
+        self.last_path = None
+        self.total_bytes = 0
+        self.total_tokens = 0
+
+    def begin(self, project_path, tree, deleted=None):
+        self.tree = tree
+
+    def add_file(self, record):
+        header = f"\n{'='*80}\n--- FICHIER: {record_title(record)}\n{'='*80}\n\n"
+        self.chunks.append(header + record['content'])
+        # Les sections d'un même fichier se suivent : elles ne comptent que pour un fichier.
+        if record['path'] != self.last_path:
+            self.files += 1
+            self.last_path = record['path']
+
+    def close(self, tree_only=False):
+        if tree_only:
+            full_body = self.tree
+            self.stats = "N/A (Mode arbre uniquement)"
+        else:
+            body_content_str = "".join(self.chunks)
+            full_body = self.tree + "\n\n" + "-"*80 + "\nCONTENU DES FICHIERS\n" + "-"*80 + "\n\n" + body_content_str
+            self.total_bytes = len(full_body.encode(self.encoding))
+            self.total_tokens = count_tokens(full_body)
+            self.stats = format_stats(self.total_bytes, self.total_tokens)
+        self.stream.write("".join([
+            "Ce fichier est une concaténation de plusieurs fichiers sources d'un projet.\n",
+            f"Date de génération : {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n",
+            f"Statistiques du contenu : {self.stats}\n\n",
+            full_body
+        ]))
+        self.stream.close()
+
+class StreamingContextWriter:
+    """Base des formats écrits fichier par fichier : les totaux sont émis en fin de flux."""
+    per_file_tokens = True
+
+    def __init__(self, stream, encoding='utf-8'):
+        self.stream = stream
+        self.encoding = encoding
+        self.files = 0
+        self.last_path = None
+        self.total_bytes = 0
+        self.total_tokens = 0
+        self.stats = ""
+
+    def add_file(self, record):
+        if record['path'] != self.last_path:
+            self.files += 1
+            self.last_path = record['path']
+        self.total_bytes += record['bytes']
+        # Un compte indisponible ('N/A', 'Erreur') rend le total indisponible.
+        if not isinstance(record['tokens'], int):
+            self.total_tokens = record['tokens']
+        elif isinstance(self.total_tokens, int):
+            self.total_tokens += record['tokens']
+        self.write_file(record)
+
+    def close(self, tree_only=False):
+        if tree_only:
+            self.stats = "N/A (Mode arbre uniquement)"
+        else:
+            self.stats = format_stats(self.total_bytes, self.total_tokens)
+        self.write_summary()
+        self.stream.close()
+
+class JsonlContextWriter(StreamingContextWriter):
+    """Un enregistrement JSON par ligne : l'arbre, puis un par fichier, puis le résumé."""
+    def _write(self, obj):
+        self.stream.write(json.dumps(obj, ensure_ascii=False) + "\n")
+
+    def begin(self, project_path, tree, deleted=None):
+        record = {
+            'type': 'tree',
+            'project': str(project_path),
+            'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'tree': tree,
+        }
+        # En différentiel, les fichiers supprimés sont aussi listés hors du texte de l'arbre.
+        if deleted is not None:
+            record['deleted'] = deleted
+        self._write(record)
+
+    def write_file(self, record):
+        self._write({'type': 'file', **record})
+
+    def write_summary(self):
+        self._write({'type': 'summary', 'files': self.files, 'bytes': self.total_bytes, 'tokens': self.total_tokens})
+
+class MarkdownContextWriter(StreamingContextWriter):
+    """Markdown avec un bloc de code délimité par fichier."""
+    def begin(self, project_path, tree, deleted=None):
+        self.stream.write(
+            f"# Contexte du projet `{project_path.name}`\n\n"
+            f"Date de génération : {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+            f"## Arbre du projet\n\n```\n{tree}\n```\n\n"
+            "## Contenu des fichiers\n"
+        )
+
+    def write_file(self, record):
+        # La clôture doit être plus longue que toute suite de ` présente dans le contenu.
+        longest = max((len(run) for run in re.findall(r'`+', record['content'])), default=0)
+        fence = '`' * max(3, longest + 1)
+        language = Path(record['path']).suffix.lstrip('.')
+        body = record['content'].rstrip('\n')
+        title = f"`{record['path']}`" + record_details(record)
+        self.stream.write(f"\n### {title}\n\n{fence}{language}\n{body}\n{fence}\n")
+
+    def write_summary(self):
+        self.stream.write(f"\n---\n\nStatistiques du contenu : {self.stats}\n")
+
+CONTEXT_WRITERS = {'txt': TextContextWriter, 'jsonl': JsonlContextWriter, 'md': MarkdownContextWriter}
+
+# --- Sélection par pertinence (index lexical BM25) ---
+
+LEXICAL_INDEX_VERSION = 1
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Un nom de classe ou de fonction pèse plus qu'une occurrence quelconque dans le code.
+SYMBOL_BOOST = 3
+
+def lexical_terms(text):
+    """Découpe un texte en termes : identifiants complets et leurs parties (snake_case, camelCase)."""
+    terms = []
+    for word in re.findall(r'[A-Za-z0-9_]+', text):
+        parts = [p for p in re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', word).lower().split('_') if len(p) > 1]
+        word = word.lower()
+        if len(word) > 1:
+            terms.append(word)
+        if len(parts) > 1 or (parts and parts[0] != word):
+            terms.extend(parts)
+    return terms
+
+def iter_python_symbols(tree):
+    """Noms qualifiés des classes, fonctions et méthodes (les nœuds parcourus par get_python_headers)."""
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            yield node.name
+            if isinstance(node, ast.ClassDef):
+                for method_node in node.body:
+                    if isinstance(method_node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                        yield f"{node.name}.{method_node.name}"
+
+def document_terms(relative_path, content):
+    tf = collections.Counter(lexical_terms(content))
+    tf.update(lexical_terms(relative_path))
+    if relative_path.endswith('.py'):
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            tree = None
+        if tree is not None:
+            for symbol in iter_python_symbols(tree):
+                for term in lexical_terms(symbol):
+                    tf[term] += SYMBOL_BOOST
+    return tf
+
+class LexicalIndex:
+    """
+    Index inversé local (terme -> {fichier: fréquence}) pour le classement BM25.
+    Incrémental : un fichier n'est réindexé que si son mtime ou sa taille a changé.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.docs = {}
+        self.postings = {}
+        self.reindexed = 0
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path)
+        data = read_json_index(path, LEXICAL_INDEX_VERSION)
+        if data is not None:
+            index.docs = data.get('docs', {})
+            index.postings = data.get('postings', {})
+        return index
+
+    def _remove(self, relative_path):
+        self.dirty = True
+        for term in self.docs.pop(relative_path)['terms']:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(relative_path, None)
+                if not postings:
+                    del self.postings[term]
+
+    def update(self, project_path, relative_paths, encoding='utf-8'):
+        wanted = set(relative_paths)
+        for relative_path in [rel for rel in self.docs if rel not in wanted]:
+            self._remove(relative_path)
+        for relative_path in relative_paths:
+            try:
+                st = os.stat(project_path / relative_path)
+            except OSError:
+                continue
+            doc = self.docs.get(relative_path)
+            if doc is not None and doc['mtime'] == st.st_mtime_ns and doc['size'] == st.st_size:
+                continue
+            try:
+                with open(project_path / relative_path, 'r', encoding=encoding, errors='ignore') as f:
+                    content = f.read()
+            except OSError:
+                continue
+            if doc is not None:
+                self._remove(relative_path)
+            tf = document_terms(relative_path, content)
+            self.docs[relative_path] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'len': sum(tf.values()), 'terms': list(tf)}
+            for term, count in tf.items():
+                self.postings.setdefault(term, {})[relative_path] = count
+            self.reindexed += 1
+            self.dirty = True
+
+    def search(self, query):
+        """Retourne [(score, chemin)] triés par pertinence décroissante (scores nuls exclus)."""
+        n_docs = len(self.docs)
+        if not n_docs:
+            return []
+        avg_len = sum(doc['len'] for doc in self.docs.values()) / n_docs or 1
+        scores = collections.defaultdict(float)
+        for term in set(lexical_terms(query)):
+            postings = self.postings.get(term, {})
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for relative_path, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.docs[relative_path]['len'] / avg_len)
+                scores[relative_path] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(((score, rel) for rel, score in scores.items()), key=lambda hit: (-hit[0], path_sort_key(hit[1])))
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+        write_json_atomic(self.path, {'version': LEXICAL_INDEX_VERSION, 'docs': self.docs, 'postings': self.postings})
+
+def select_by_query(ranked, candidates, project_path, args, full_body_filters, token_budget=None, transform=transform_content):
+    """
+    Remplit le budget de tokens avec les fichiers les mieux classés (contenu complet,
+    sinon, avec --chunk-lines, les sections du fichier qui correspondent à la requête,
+    sinon les en-têtes), puis avec les en-têtes des fichiers Python voisins (même
+    dossier) des fichiers retenus en entier ou par sections.
+    Retourne [(chemin, mode, contenu transformé ou liste de sections)] et le nombre
+    de tokens utilisés.
+    """
+    selection, used, taken, full_hits = [], 0, set(), []
+
+    def try_add(relative_path, modes, content):
+        nonlocal used
+        for mode in modes:
+            transformed = transform(content, project_path / relative_path, mode, full_body_filters)
+            tokens = estimate_tokens(transformed)
+            if token_budget is None or used + tokens <= token_budget:
+                selection.append((relative_path, mode, transformed))
+                used += tokens
+                taken.add(relative_path)
+                return mode
+        return None
+
+    def try_add_sections(relative_path, mode, content):
+        nonlocal used
+        transformed = transform(content, project_path / relative_path, mode, full_body_filters)
+        sections = split_sections(relative_path, mode, transformed, args.chunk_lines)
+        if sections is None:
+            return False
+        query_terms = set(lexical_terms(args.query))
+        scored = []
+        for index, section in enumerate(sections):
+            tf = collections.Counter(lexical_terms(section['content']))
+            for term in lexical_terms(section['symbol']):
+                tf[term] += SYMBOL_BOOST
+            score = sum(tf[term] for term in query_terms)
+            if score:
+                scored.append((-score, index))
+        chosen = []
+        for _, index in sorted(scored):
+            tokens = estimate_tokens(sections[index]['content'])
+            if token_budget is None or used + tokens <= token_budget:
+                chosen.append(index)
+                used += tokens
+        if not chosen:
+            return False
+        selection.append((relative_path, mode, [sections[index] for index in sorted(chosen)]))
+        taken.add(relative_path)
+        return True
+
+    def read(relative_path):
+        try:
+            with open(project_path / relative_path, 'r', encoding=args.encoding, errors='ignore') as f:
+                return f.read()
+        except OSError as e:
+            logging.error(f"  -> ERREUR: Impossible de lire {relative_path}. Erreur: {e}")
+            return None
+
+    for _, relative_path in ranked:
+        content = read(relative_path)
+        if content is None:
+            continue
+        mode = get_processing_mode(project_path / relative_path, args)
+        if try_add(relative_path, [mode], content) is not None:
+            if mode != 'headers':
+                full_hits.append(relative_path)
+        elif mode != 'headers' and relative_path.endswith('.py'):
+            if try_add_sections(relative_path, mode, content):
+                full_hits.append(relative_path)
+            else:
+                try_add(relative_path, ['headers'], content)
+
+    by_dir = collections.defaultdict(list)
+    for relative_path in candidates:
+        if relative_path.endswith('.py'):
+            by_dir[relative_path.rpartition('/')[0]].append(relative_path)
+    for hit in full_hits:
+        for neighbour in by_dir[hit.rpartition('/')[0]]:
+            if neighbour not in taken:
+                content = read(neighbour)
+                if content is not None:
+                    try_add(neighbour, ['headers'], content)
+
+    return selection, used
+
+# --- Graphe d'imports Python ---
+
+IMPORT_GRAPH_VERSION = 1
+
+def extract_imports(content):
+    """Liste les imports d'un module : [module, [noms importés], niveau relatif]."""
+    imports = []
+    for node in ast.walk(ast.parse(content)):
+        if isinstance(node, ast.Import):
+            imports.extend([alias.name, [], 0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imports.append([node.module or '', [alias.name for alias in node.names], node.level])
+    return imports
+
+def module_name(relative_path):
+    """'pkg/sub/mod.py' -> 'pkg.sub.mod', 'pkg/__init__.py' -> 'pkg'."""
+    parts = relative_path[:-len('.py')].split('/')
+    if parts[-1] == '__init__':
+        parts = parts[:-1]
+    return '.'.join(parts)
+
+def join_module(*parts):
+    return '.'.join(p for p in parts if p)
+
+class ImportGraph:
+    """
+    Graphe des dépendances entre modules locaux, construit par analyse statique (ast).
+    Les imports de chaque fichier sont mis en cache et relus seulement si son mtime ou sa taille change.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.files = {}
+        self.reparsed = 0
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        graph = cls(path)
+        data = read_json_index(path, IMPORT_GRAPH_VERSION)
+        if data is not None:
+            graph.files = data.get('files', {})
+        return graph
+
+    def update(self, project_path, python_files, encoding='utf-8'):
+        files = {}
+        for relative_path in python_files:
+            try:
+                st = os.stat(project_path / relative_path)
+            except OSError:
+                continue
+            cached = self.files.get(relative_path)
+            if cached is not None and cached['mtime'] == st.st_mtime_ns and cached['size'] == st.st_size:
+                files[relative_path] = cached
+                continue
+            try:
+                with open(project_path / relative_path, 'r', encoding=encoding, errors='ignore') as f:
+                    imports = extract_imports(f.read())
+            except (OSError, SyntaxError, ValueError) as e:
+                logging.warning(f"  -> AVERTISSEMENT: Imports de {relative_path} non analysables ({e}).")
+                imports = []
+            files[relative_path] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'imports': imports}
+            self.reparsed += 1
+        self.dirty = self.dirty or self.reparsed > 0 or files.keys() != self.files.keys()
+        self.files = files
+
+    def resolve(self):
+        """Retourne {fichier: [fichiers locaux importés]} ; les modules externes sont ignorés."""
+        modules = {}
+        for relative_path in sorted(self.files, key=path_sort_key):
+            name = module_name(relative_path)
+            modules.setdefault(name, relative_path)
+            # Disposition 'src/' : le paquet est importé sans le préfixe.
+            if name.startswith('src.'):
+                modules.setdefault(name[len('src.'):], relative_path)
+
+        graph = {}
+        for relative_path, entry in self.files.items():
+            name = module_name(relative_path)
+            package = name.split('.') if relative_path.endswith('__init__.py') else name.split('.')[:-1]
+            script_package = '.'.join(relative_path.split('/')[:-1])
+            deps = []
+            for module, names, level in entry['imports']:
+                if level:
+                    if level - 1 > len(package):
+                        continue
+                    prefixes = [join_module(*package[:len(package) - (level - 1)], module)]
+                else:
+                    # Absolu depuis la racine du projet, puis depuis le dossier du fichier (exécution en script).
+                    prefixes = [module] + ([join_module(script_package, module)] if script_package else [])
+                for prefix in prefixes:
+                    targets = [modules.get(join_module(prefix, n)) for n in names if n != '*']
+                    targets.append(modules.get(prefix))
+                    targets = [t for t in targets if t and t != relative_path]
+                    if targets:
+                        deps.extend(t for t in targets if t not in deps)
+                        break
+            graph[relative_path] = deps
+        return graph
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+        write_json_atomic(self.path, {'version': IMPORT_GRAPH_VERSION, 'files': self.files})
+
+def reachable_modules(graph, entry, depth):
+    """Parcours en largeur depuis `entry` : {fichier: distance} jusqu'à `depth` niveaux d'imports."""
+    distances = {entry: 0}
+    frontier = [entry]
+    for distance in range(1, depth + 1):
+        next_frontier = []
+        for relative_path in frontier:
+            for dep in graph.get(relative_path, []):
+                if dep not in distances:
+                    distances[dep] = distance
+                    next_frontier.append(dep)
+        frontier = next_frontier
+    return distances
+
+# --- Manifeste et sortie différentielle ---
+
+MANIFEST_VERSION = 1
+
+def content_digest(content):
+    return hashlib.sha256(content.encode('utf-8', 'surrogatepass')).hexdigest()
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERREUR: Impossible de lire le manifeste '{manifest_path}': {e}")
+    if manifest.get('version') != MANIFEST_VERSION:
+        sys.exit(f"ERREUR: Version de manifeste non prise en charge dans '{manifest_path}'.")
+    return manifest
+
+def transform_parameters(args, full_body_filters):
+    """Paramètres qui, à source identique, changent le contenu ou les sections émis."""
+    return {'full_body_filters': list(full_body_filters), 'chunk_lines': args.chunk_lines, 'encoding': args.encoding}
+
+def write_manifest(manifest_path, project_path, output_path, tree_entries, files, transform=None):
+    """
+    Enregistre, à côté de la sortie, l'empreinte du contenu émis pour chaque fichier
+    (avec son mode, son mtime et sa taille), les entrées de l'arbre et les paramètres
+    de transformation : c'est la référence d'un futur --since.
+    """
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'project': str(project_path),
+        'output': str(output_path),
+        'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'transform': transform,
+        'tree': tree_entries,
+        'files': files,
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(manifest, ensure_ascii=False, separators=(',', ':')))
+
+def render_tree_delta(project_path, previous, tree_entries, deleted_files):
+    """Remplace l'arbre complet en sortie différentielle : entrées ajoutées/retirées et fichiers supprimés."""
+    previous_tree = set(previous.get('tree', []))
+    current_tree = set(tree_entries)
+    added = sorted(current_tree - previous_tree, key=path_sort_key)
+    removed = sorted(previous_tree - current_tree, key=path_sort_key)
+    lines = [f"Arbre du projet : {project_path} (delta depuis le contexte du {previous.get('generated_at', '?')})"]
+    if added:
+        lines.append("Entrées ajoutées à l'arbre :")
+        lines.extend(f"+ {entry}" for entry in added)
+    if removed:
+        lines.append("Entrées retirées de l'arbre :")
+        lines.extend(f"- {entry}" for entry in removed)
+    if not added and not removed:
+        lines.append("Aucune modification de l'arbre.")
+    if deleted_files:
+        lines.append("Fichiers supprimés depuis le contexte précédent :")
+        lines.extend(f"- {path}" for path in deleted_files)
+    return "\n".join(lines)
+
+# --- Mode plan (estimation sans lecture du contenu) ---
+
+# Ratio par défaut, faute d'échantillon : ~4 octets par token pour du code source.
+BYTES_PER_TOKEN = 4.0
+
+def sample_fraction(value):
+    """Type argparse pour --sample : une fraction dans ]0, 1]."""
+    fraction = float(value)
+    if not 0 < fraction <= 1:
+        raise argparse.ArgumentTypeError(f"{value} n'est pas une fraction dans ]0, 1]")
+    return fraction
+
+def build_plan(project_path, selection, encoding, full_body_filters, transform_cache=None, sample=None):
+    """
+    Estime la sortie à partir des seules métadonnées (stat) des fichiers sélectionnés.
+    Avec `sample`, une fraction des fichiers est lue et transformée pour calibrer le
+    ratio tokens/octet (qui tient alors compte de --strip-comments/--headers-only).
+    """
+    files = []
+    for relative_path, mode, _ in selection:
+        try:
+            size = os.stat(project_path / relative_path).st_size
+        except OSError:
+            continue
+        files.append({'path': relative_path, 'mode': mode, 'bytes': size})
+
+    tokens_per_byte = 1 / BYTES_PER_TOKEN
+    sampled = 0
+    if sample and files:
+        # Tirage déterministe : deux plans successifs restent comparables.
+        picked = random.Random(0).sample(files, min(len(files), math.ceil(len(files) * sample)))
+        sample_bytes = sample_tokens = 0
+        for file_info in picked:
+            content, error = read_and_transform((file_info['path'], file_info['mode']), project_path, encoding,
+                                                full_body_filters, transform_cache)
+            if error is not None:
+                continue
+            sample_bytes += file_info['bytes']
+            sample_tokens += estimate_tokens(content)
+            sampled += 1
+        if sample_bytes:
+            tokens_per_byte = sample_tokens / sample_bytes
+
+    directories = {}
+    for file_info in files:
+        file_info['tokens'] = round(file_info['bytes'] * tokens_per_byte)
+        # Totaux cumulés : chaque fichier compte pour tous ses dossiers parents ('.' = racine).
+        parts = file_info['path'].split('/')[:-1]
+        for depth in range(len(parts) + 1):
+            directory = '/'.join(parts[:depth]) or '.'
+            totals = directories.setdefault(directory, {'path': directory, 'files': 0, 'bytes': 0, 'tokens': 0})
+            totals['files'] += 1
+            totals['bytes'] += file_info['bytes']
+            totals['tokens'] += file_info['tokens']
+
+    return {
+        'project': str(project_path),
+        'total_files': len(files),
+        'total_bytes': sum(f['bytes'] for f in files),
+        'estimated_tokens': sum(f['tokens'] for f in files),
+        'tokens_per_byte': tokens_per_byte,
+        'sample': sample,
+        'sampled_files': sampled,
+        'directories': sorted(directories.values(), key=lambda d: path_sort_key(d['path']) if d['path'] != '.' else []),
+        'files': files,
+    }
 
-def main():
+def print_plan(plan):
+    calibration = (f"ratio calibré sur {plan['sampled_files']} fichier(s) échantillonné(s)" if plan['sampled_files']
+                   else f"ratio par défaut de {BYTES_PER_TOKEN:g} octets/token")
+    print(f"Plan : {plan['total_files']} fichiers, {format_bytes(plan['total_bytes'])}, "
+          f"~{plan['estimated_tokens']:,} tokens estimés ({calibration}).")
+    print("Par dossier (premier niveau) :")
+    for directory in plan['directories']:
+        if directory['path'] == '.' or '/' not in directory['path']:
+            label = directory['path'] if directory['path'] == '.' else directory['path'] + '/'
+            print(f"  {label:<40} {directory['files']:>7} fichiers {format_bytes(directory['bytes']):>10} "
+                  f"~{directory['tokens']:>10,} tokens")
+
+# --- Configuration ---
+
+DEFAULT_CONFIG = {
+    'output_path': './build/project_context.txt',
+    'include_patterns': ['**/*'],
+    'common_filters': ['__pycache__/', '*.pyc', '.git/', '.venv/', 'venv/', 'node_modules/', 'build/', 'dist/', '.idea/', '.vscode/'],
+    'project_only_filters': [],
+    'tree_only_filters': ['*.md', 'LICENSE', '.gitignore', 'config.yaml'],
+    'full_body_filters': ['main', 'run_app', 'settings', 'configure_*'],
+    'follow_symlinks': False
+}
+
+def build_arg_parser():
     parser = argparse.ArgumentParser(description="Agrège les fichiers d'un projet en un seul fichier texte pour une IA.")
-    # ... (les arguments n'ont pas changé) ...
     parser.add_argument('-c', '--config', type=str, help="Chemin vers le fichier de configuration YAML.")
     parser.add_argument('-p', '--project', type=str, help="Chemin vers le projet cible.")
     parser.add_argument('-o', '--output', type=str, help="Chemin vers le fichier de sortie.")
@@ -239,21 +1458,28 @@ def main():
     parser.add_argument('--headers-only', action='store_true', help="Ne conserver que les signatures de fonctions/méthodes.")
     parser.add_argument('--tree-only', action='store_true', help="Génère uniquement l'arbre du projet avec le poids des fichiers en Ko, sans leur contenu.")
     parser.add_argument('--dry-run', action='store_true', help="Simule l'opération sans écrire de fichier.")
+    parser.add_argument('--plan', action='store_true', help="Estime la sortie (liste des fichiers, octets par dossier, tokens) à partir des seules métadonnées, sans lire le contenu. Écrit un rapport .plan.json (sauf avec --dry-run).")
+    parser.add_argument('--sample', type=sample_fraction, help="Avec --plan : fraction des fichiers (ex. 0.05) lue pour calibrer l'estimation des tokens.")
     parser.add_argument('--encoding', type=str, default='utf-8', help="Encodage des fichiers (défaut: utf-8).")
     parser.add_argument('--use-gitignore', action='store_true', help="Utilise le .gitignore du projet pour filtrer les fichiers.")
+    parser.add_argument('--no-scan-cache', action='store_true', help="Désactive l'index de scan persistant (relit toute l'arborescence).")
+    selection_group = parser.add_mutually_exclusive_group()
+    selection_group.add_argument('--query', type=str, help="Ne retient que les fichiers pertinents pour cette requête (classement BM25 sur un index local mis en cache).")
+    selection_group.add_argument('--entry', type=str, help="Module Python d'entrée : ne retient que les modules locaux qu'il importe (transitivement).")
+    parser.add_argument('--token-budget', type=int, help="Avec --query : nombre maximal de tokens de contenu à inclure.")
+    parser.add_argument('--depth', type=int, default=2, help="Avec --entry : profondeur d'imports suivie. Les dépendances directes sont complètes, les plus profondes réduites aux en-têtes (défaut: 2).")
+    parser.add_argument('--chunk-lines', type=int, help="Découpe les fichiers Python de plus de N lignes en sections par classe, méthode et fonction, chacune avec son nom qualifié et son compte de tokens.")
+    parser.add_argument('--since', type=str, help="Manifeste (.manifest.json) d'un contexte précédent : n'émet que les fichiers ajoutés ou modifiés, la liste des fichiers supprimés et le delta de l'arbre.")
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS), default='txt', help="Format de sortie : texte historique, JSONL (un enregistrement par fichier) ou Markdown (défaut: txt).")
+    parser.add_argument('--compress', choices=sorted(OUTPUT_COMPRESSIONS), default='none', help="Compresse la sortie à la volée avec gzip ou zstd (défaut: none).")
+    parser.add_argument('-j', '--jobs', type=int, help="Nombre de processus de travail pour la transformation des fichiers, ou pour les projets en mode --batch (défaut: 1, nombre de CPU en batch).")
+    parser.add_argument('--batch', type=str, help="Manifeste YAML listant plusieurs projets à traiter avec un pool de processus partagé. -o désigne alors le dossier de sortie.")
+    parser.add_argument('--no-transform-cache', action='store_true', help="Désactive le cache disque des contenus transformés (--strip-comments, --headers-only).")
     parser.add_argument('-v', '--verbose', action='store_true', help="Affiche des informations détaillées sur la console.")
-    args = parser.parse_args()
-
-    DEFAULT_CONFIG = {
-        'output_path': './build/project_context.txt',
-        'include_patterns': ['**/*'],
-        'common_filters': ['__pycache__/', '*.pyc', '.git/', '.venv/', 'venv/', 'node_modules/', 'build/', 'dist/', '.idea/', '.vscode/'],
-        'project_only_filters': [],
-        'tree_only_filters': ['*.md', 'LICENSE', '.gitignore', 'config.yaml'],
-        'full_body_filters': ['main', 'run_app', 'settings', 'configure_*']
-    }
-    
-    # ... (la logique de configuration n'a pas changé) ...
+    return parser
+
+def load_config(args):
+    """Fusionne le fichier de configuration (s'il existe) sur DEFAULT_CONFIG."""
     config = DEFAULT_CONFIG.copy()
     script_dir = Path(__file__).resolve().parent
     config_path = Path(args.config or script_dir / 'config.yaml')
@@ -264,20 +1490,36 @@ def main():
                 config.update(yaml.safe_load(f) or {})
         except yaml.YAMLError as e:
             sys.exit(f"ERREUR: Impossible de parser le fichier de configuration '{config_path}': {e}")
+    return config, config_path
+
+# --- Fonction principale ---
 
+def run_project(args, config, config_path=None):
+    """
+    Génère le contexte d'un projet. `config_path` est None lorsque la configuration
+    ne provient pas d'un fichier (mode batch).
+    Retourne un résumé : chemins de sortie, nombre de fichiers, octets et tokens.
+    """
     project_path = Path(args.project or config.get('project_path', '.')).resolve()
+    if not project_path.is_dir():
+        sys.exit(f"ERREUR: Le projet '{project_path}' n'existe pas ou n'est pas un dossier.")
     output_path_str = args.output or config.get('output_path')
     
     output_path = Path(output_path_str)
     if not args.no_timestamp:
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         output_path = output_path.with_name(f"{output_path.stem}_{timestamp}{output_path.suffix}")
+    if args.format != 'txt':
+        output_path = output_path.with_suffix(OUTPUT_FORMATS[args.format])
 
     log_path = output_path.with_suffix('.log')
+    output_path = output_path.with_name(output_path.name + OUTPUT_COMPRESSIONS[args.compress])
     setup_logging(log_path, args.verbose)
 
     if args.dry_run: print("--- MODE DRY RUN ACTIVÉ : AUCUN FICHIER NE SERA ÉCRIT ---")
-    if not config_path.exists():
+    if config_path is None:
+        logging.info("Configuration issue du manifeste de batch, fusionnée sur la configuration par défaut")
+    elif not config_path.exists():
         with open(config_path, 'w', encoding=args.encoding) as f: yaml.dump(DEFAULT_CONFIG, f, sort_keys=False, allow_unicode=True)
         logging.info(f"Fichier de configuration par défaut créé à '{config_path}'")
     else:
@@ -302,6 +1544,9 @@ def main():
     auto_exclude_pattern = f'{output_path_base}*'
     final_project_filters.append(auto_exclude_pattern)
     final_tree_filters.append(auto_exclude_pattern)
+    # Le cache de l'outil ne doit jamais se retrouver dans le contexte.
+    final_project_filters.append(f'{SCAN_CACHE_DIRNAME}/')
+    final_tree_filters.append(f'{SCAN_CACHE_DIRNAME}/')
     
     if args.use_gitignore:
         gitignore_path = project_path / '.gitignore'
@@ -316,98 +1561,457 @@ def main():
     project_exclude_spec = pathspec.PathSpec.from_lines('gitwildmatch', final_project_filters)
     tree_exclude_spec = pathspec.PathSpec.from_lines('gitwildmatch', final_tree_filters)
 
-    logging.info("="*50)
-    logging.info("CONFIGURATION FINALE DES FILTRES DE DÉBOGAGE")
-    logging.info(f"  - PATTERNS D'INCLUSION: {include_patterns}")
-    logging.info(f"  - FILTRES D'EXCLUSION (CONTENU): {final_project_filters}")
-    logging.info(f"  - FILTRES D'EXCLUSION (ARBRE): {final_tree_filters}")
-    logging.info("="*50)
+    if args.verbose:
+        logging.debug("="*50)
+        logging.debug("CONFIGURATION FINALE DES FILTRES DE DÉBOGAGE")
+        logging.debug(f"  - PATTERNS D'INCLUSION: {include_patterns}")
+        logging.debug(f"  - FILTRES D'EXCLUSION (CONTENU): {final_project_filters}")
+        logging.debug(f"  - FILTRES D'EXCLUSION (ARBRE): {final_tree_filters}")
+        logging.debug("="*50)
+    else:
+        logging.info(f"Filtres : {len(include_patterns)} pattern(s) d'inclusion, {len(final_project_filters)} d'exclusion (contenu), "
+                     f"{len(final_tree_filters)} d'exclusion (arbre). Détail avec --verbose.")
 
-    logging.info("Génération de l'arbre du projet...")
-    project_tree = generate_tree(project_path, include_spec, tree_exclude_spec, show_sizes=args.tree_only)
-    
-    print("Concaténation des fichiers...")
-    all_files_content = []
+    # Liens symboliques vers des dossiers : affichés sans être parcourus, sauf avec follow_symlinks.
+    follow_symlinks = bool(config.get('follow_symlinks'))
+    if follow_symlinks:
+        logging.info("Suivi des liens symboliques vers des dossiers activé (dossiers déjà visités ignorés).")
+
+    # Index de scan : partagé entre l'arbre et la recherche de fichiers, persisté entre deux exécutions.
+    cache_dir = Path(config.get('cache_dir') or Path(output_path_str).parent / SCAN_CACHE_DIRNAME)
+    if args.no_scan_cache:
+        scan_index = ScanIndex()
+    else:
+        filters_key = compute_filters_key(project_path, include_patterns, final_project_filters, final_tree_filters, [follow_symlinks])
+        scan_index = ScanIndex.load(cache_dir / f"scan_{filters_key}.json", filters_key)
+
+    if args.plan:
+        tree_paths, tree_dirs = [], set()
+    else:
+        logging.info("Génération de l'arbre du projet...")
+        tree_paths, tree_dirs = collect_tree_paths(project_path, include_spec, tree_exclude_spec, scan_index, follow_symlinks)
     
+        print("Concaténation des fichiers...")
+
     # <<< MODIFICATION : Remplacement de la recherche de fichiers en deux étapes par une seule boucle optimisée.
     logging.info("Recherche optimisée des fichiers (avec élagage des dossiers exclus)...")
     final_file_list = []
-    for root, dirs, files in os.walk(project_path, topdown=True):
-        # Élagage des dossiers exclus pour que os.walk ne les visite pas.
-        # On modifie la liste `dirs` en place.
-        excluded_dirs = []
-        for d in dirs:
-            # On vérifie le chemin relatif du dossier. ex: 'node_modules/'
-            dir_path_str = str((Path(root) / d).relative_to(project_path)).replace('\\', '/')
-            if project_exclude_spec.match_file(dir_path_str) or project_exclude_spec.match_file(dir_path_str + '/'):
-                excluded_dirs.append(d)
-        
-        for d in excluded_dirs:
-            dirs.remove(d)
-
-        # Traitement des fichiers dans le dossier courant (qui n'est pas exclus)
-        for filename in files:
-            file_path = Path(root) / filename
-            relative_path_str = str(file_path.relative_to(project_path)).replace('\\', '/')
-            
-            # Un fichier est inclus s'il correspond aux inclusions ET ne correspond PAS aux exclusions.
-            if include_spec.match_file(relative_path_str) and not project_exclude_spec.match_file(relative_path_str):
-                final_file_list.append(file_path)
-
-    final_file_list.sort() # Trier la liste pour un traitement ordonné
+    for _, rel_dir, _, matched_files in walk_filtered(project_path, include_spec, project_exclude_spec, 'content', scan_index, follow_symlinks):
+        # Un fichier est inclus s'il correspond aux inclusions ET ne correspond PAS aux exclusions.
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        final_file_list.extend(prefix + filename for filename in matched_files)
+
+    if not args.dry_run:
+        scan_index.save()
+    logging.info(f"Index de scan : {scan_index.relisted} dossier(s) relisté(s) sur {len(scan_index.visited)}.")
+    special_files = [f"{rel_dir}/{name}" if rel_dir else name
+                     for rel_dir, entry in scan_index.visited.items() for name in entry['special']]
+    if special_files:
+        logging.info(f"{len(special_files)} fichier(s) spécial(aux) ignoré(s) (FIFO, socket, périphérique ou lien cassé).")
+        if args.verbose:
+            for p in sorted(special_files, key=path_sort_key):
+                logging.debug(f"  [SPÉCIAL] {p}")
+
+    final_file_list.sort(key=path_sort_key) # Trier la liste pour un traitement ordonné
     logging.info(f"{len(final_file_list)} fichiers finaux trouvés après filtrage optimisé.")
-    logging.info("--- LISTE DES FICHIERS À TRAITER ---")
-    for p in final_file_list:
-        logging.info(f"  [INCLUS] {str(p.relative_to(project_path)).replace('\\', '/')}")
-    logging.info("--- FIN DE LA LISTE ---")
+    if args.verbose:
+        logging.debug("--- LISTE DES FICHIERS À TRAITER ---")
+        for p in final_file_list:
+            logging.debug(f"  [INCLUS] {p}")
+        logging.debug("--- FIN DE LA LISTE ---")
+
+    # Avec --dry-run, le cache est lu mais n'est pas écrit, comme les index ci-dessus.
+    transform_cache = None if args.no_transform_cache else TransformCache(cache_dir / 'transforms', read_only=args.dry_run)
+    transform = transform_cache.transform if transform_cache else transform_content
+
+    # Sélection : par défaut tous les fichiers filtrés, lus et transformés au fil de l'écriture.
+    selection = [(p, get_processing_mode(project_path / p, args), None) for p in final_file_list]
+    if args.query and not args.tree_only:
+        lexical_index = LexicalIndex.load(cache_dir / f"lexical_{compute_filters_key(project_path)}.json")
+        lexical_index.update(project_path, final_file_list, args.encoding)
+        if not args.dry_run:
+            lexical_index.save()
+        ranked = lexical_index.search(args.query)
+        selection, used_tokens = select_by_query(ranked, final_file_list, project_path, args, full_body_filters, args.token_budget, transform)
+        logging.info(f"Requête '{args.query}' : {len(ranked)} fichier(s) pertinent(s), {len(selection)} retenu(s), "
+                     f"~{used_tokens} tokens ({lexical_index.reindexed} fichier(s) réindexé(s)).")
+        if args.verbose:
+            for relative_path, mode, content in selection:
+                symbols = f" : {', '.join(section['symbol'] for section in content)}" if isinstance(content, list) else ""
+                logging.debug(f"  [RETENU] {relative_path} ({mode}){symbols}")
+    elif args.entry and not args.tree_only:
+        entry_path = Path(args.entry)
+        if entry_path.is_absolute():
+            try:
+                entry_path = entry_path.resolve().relative_to(project_path)
+            except ValueError:
+                sys.exit(f"ERREUR: Le module d'entrée '{args.entry}' n'est pas situé dans le projet '{project_path}'.")
+        entry = entry_path.as_posix()
+        python_files = [p for p in final_file_list if p.endswith('.py')]
+        if entry not in python_files:
+            sys.exit(f"ERREUR: Le module d'entrée '{entry}' ne fait pas partie des fichiers Python retenus par les filtres.")
+        import_graph = ImportGraph.load(cache_dir / f"imports_{compute_filters_key(project_path)}.json")
+        import_graph.update(project_path, python_files, args.encoding)
+        if not args.dry_run:
+            import_graph.save()
+        distances = reachable_modules(import_graph.resolve(), entry, args.depth)
+        selection = [
+            (p, get_processing_mode(project_path / p, args) if distance <= 1 else 'headers', None)
+            for p, distance in sorted(distances.items(), key=lambda item: (item[1], path_sort_key(item[0])))
+        ]
+        logging.info(f"Graphe d'imports depuis '{entry}' (profondeur {args.depth}) : {len(selection)} module(s) "
+                     f"({import_graph.reparsed} fichier(s) réanalysé(s)).")
+        if args.verbose:
+            for relative_path, mode, _ in selection:
+                logging.debug(f"  [RETENU] {relative_path} ({mode}, distance {distances[relative_path]})")
+
+    if args.plan:
+        plan = build_plan(project_path, selection, args.encoding, full_body_filters, transform_cache, args.sample)
+        logging.info(f"Plan : {plan['total_files']} fichiers, {plan['total_bytes']:,} octets, ~{plan['estimated_tokens']:,} tokens "
+                     f"({plan['tokens_per_byte']:.4f} token/octet, {plan['sampled_files']} fichier(s) échantillonné(s)).")
+        print_plan(plan)
+        plan_path = log_path.with_suffix('.plan.json')
+        if not args.dry_run:
+            with open(plan_path, 'w', encoding='utf-8') as f:
+                json.dump(plan, f, ensure_ascii=False, indent=2)
+            print(f"Rapport de plan généré : {plan_path.resolve()}")
+        print(f"Fichier de log généré : {log_path.resolve()}")
+        return {
+            'output': str(plan_path.resolve()),
+            'log': str(log_path.resolve()),
+            'files': plan['total_files'],
+            'bytes': plan['total_bytes'],
+            'tokens': plan['estimated_tokens'],
+            'stats': format_stats(plan['total_bytes'], f"~{plan['estimated_tokens']}"),
+        }
+
+    # Manifeste : empreintes du contenu émis, référence d'un futur --since.
+    manifest_path = log_path.with_suffix('.manifest.json')
+    manifest_files = {}
+    tree_entries = [p + '/' if p in tree_dirs else p for p in tree_paths]
+    previous = load_manifest(args.since) if args.since else None
+    transform_params = transform_parameters(args, full_body_filters)
+    if previous is None:
+        project_tree = render_tree(project_path, tree_paths, tree_dirs, show_sizes=args.tree_only)
+        previous_files = {}
+        deleted_files = None
+    else:
+        previous_files = previous.get('files', {})
+        # Supprimé = absent du scan filtré ; un fichier simplement non retenu par --query
+        # ou --entry existe toujours.
+        scanned = set(final_file_list)
+        deleted_files = sorted((p for p in previous_files if p not in scanned), key=path_sort_key)
+        project_tree = render_tree_delta(project_path, previous, tree_entries, deleted_files)
+    unchanged = 0
+
+    # Écriture en flux : chaque fichier traité est transmis au writer du format choisi.
+    if not args.dry_run:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        stream = open_output_stream(output_path, args.compress, args.encoding)
+    else:
+        stream = open(os.devnull, 'w', encoding=args.encoding)
+    writer = CONTEXT_WRITERS[args.format](stream, args.encoding)
+    writer.begin(project_path, project_tree, deleted_files)
 
     # Lecture des fichiers
     if not args.tree_only:
-        for file_path in final_file_list:
-            relative_path_str = str(file_path.relative_to(project_path))
+        # Les métadonnées sont relevées avant la lecture : un fichier modifié entre-temps
+        # aura un autre mtime au prochain passage et sera relu.
+        # Le même relevé sert à écarter, avant toute ouverture, un fichier devenu spécial
+        # depuis le scan et les doublons : liens physiques et liens symboliques vers un
+        # même fichier partagent le même (st_dev, st_ino).
+        def is_alias(relative_path):
+            path = project_path / relative_path
+            return os.path.realpath(path) != os.path.abspath(path)
+
+        file_stats, owners, kept, duplicates = {}, {}, [], 0
+        for relative_path_str, mode, content in selection:
             try:
-                with open(file_path, 'r', encoding=args.encoding, errors='ignore') as f: content = f.read()
-                logging.info(f"  -> Traitement de : {relative_path_str}")
-                
-                if args.headers_only and file_path.suffix == '.py':
-                    content = get_python_headers(content, full_body_filters)
-                elif args.strip_comments:
-                    content = strip_comments_from_code(content, file_path)
-                
-                header = f"\n{'='*80}\n--- FICHIER: {relative_path_str}\n{'='*80}\n\n"
-                all_files_content.append(header + content)
-            except IOError as e:
-                logging.error(f"  -> ERREUR: Impossible de lire {relative_path_str}. Erreur: {e}")
+                st = os.stat(project_path / relative_path_str)
+            except OSError:
+                kept.append((relative_path_str, mode, content))
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                logging.warning(f"  -> AVERTISSEMENT: {relative_path_str} n'est pas un fichier régulier, ignoré.")
+                continue
+            file_stats[relative_path_str] = st
+            kept.append((relative_path_str, mode, content))
+            key = (st.st_dev, st.st_ino)
+            owner = owners.setdefault(key, relative_path_str)
+            if owner == relative_path_str:
+                continue
+            # Le chemin réel l'emporte sur un alias (lien symbolique) ; entre liens
+            # physiques ou entre alias, le premier dans l'ordre de tri.
+            duplicates += 1
+            if is_alias(owner) and not is_alias(relative_path_str):
+                owners[key], dropped = relative_path_str, owner
+            else:
+                dropped = relative_path_str
+            logging.debug(f"  -> Doublon ignoré : {dropped} (même fichier que {owners[key]}).")
+        if duplicates:
+            kept = [item for item in kept if item[0] not in file_stats
+                    or owners[(file_stats[item[0]].st_dev, file_stats[item[0]].st_ino)] == item[0]]
+        selection = kept
+        if duplicates:
+            logging.info(f"{duplicates} doublon(s) ignoré(s) (liens physiques ou symboliques vers un fichier déjà retenu).")
+        if previous is not None and previous.get('transform') == transform_params:
+            # En différentiel, un fichier dont le mode, le mtime et la taille n'ont pas
+            # changé n'est même pas relu : son empreinte est reprise du manifeste.
+            # Si les paramètres de transformation ont changé, tout est relu et recomparé,
+            # de même qu'un fichier dont seules quelques sections avaient été émises.
+            pending = []
+            for relative_path_str, mode, content in selection:
+                before = previous_files.get(relative_path_str)
+                st = file_stats.get(relative_path_str)
+                if (content is None and before is not None and st is not None and before['mode'] == mode
+                        and not before.get('partial') and before['mtime'] == st.st_mtime_ns and before['size'] == st.st_size):
+                    manifest_files[relative_path_str] = before
+                    unchanged += 1
+                else:
+                    pending.append((relative_path_str, mode, content))
+            selection = pending
+
+        # Lecture et transformation, éventuellement réparties sur un pool de processus ;
+        # pool.map conserve l'ordre, l'écriture reste donc séquentielle et en flux.
+        todo = [(p, mode) for p, mode, content in selection if content is None]
+        worker = functools.partial(read_and_transform, project_path=project_path, encoding=args.encoding,
+                                   full_body_filters=full_body_filters, transform_cache=transform_cache)
+        jobs = args.jobs or 1
+        progress = ProgressTracker(len(selection))
+        with contextlib.ExitStack() as stack:
+            if jobs > 1 and len(todo) > 1:
+                log_queue = stack.enter_context(forward_worker_logs())
+                pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(
+                    max_workers=jobs, initializer=init_worker_logging, initargs=(log_queue, logging.getLogger().level)))
+                results = pool.map(worker, todo, chunksize=max(1, len(todo) // (jobs * 8)))
+            else:
+                results = map(worker, todo)
+
+            for relative_path_str, mode, content in selection:
+                if content is None:
+                    content, error = next(results)
+                    if error is not None:
+                        logging.error(f"  -> ERREUR: Impossible de lire {relative_path_str}. Erreur: {error}")
+                        continue
+                    if args.verbose:
+                        logging.debug(f"  -> Traitement de : {relative_path_str}")
+                # Sections déjà choisies par --query (fichier partiel), sinon découpage des gros fichiers Python.
+                partial = isinstance(content, list)
+                if partial:
+                    sections, content = content, "".join(section['content'] for section in content)
+                else:
+                    sections = split_sections(relative_path_str, mode, content, args.chunk_lines)
+                digest = content_digest(content)
+                st = file_stats.get(relative_path_str)
+                manifest_files[relative_path_str] = {'mode': mode, 'sha256': digest,
+                                                     'mtime': st.st_mtime_ns if st else None, 'size': st.st_size if st else None}
+                if sections is not None:
+                    manifest_files[relative_path_str]['sections'] = {
+                        section['symbol']: content_digest(section['content']) for section in sections}
+                if partial:
+                    # L'empreinte ne couvre que les sections retenues : elle ne peut servir
+                    # de référence à un --since ultérieur.
+                    manifest_files[relative_path_str]['partial'] = True
+                change, previous_sections = None, None
+                if previous is not None:
+                    before = previous_files.get(relative_path_str)
+                    # Une entrée partielle ne sert pas de référence : le fichier est réémis en entier.
+                    comparable = before is not None and before['mode'] == mode and not before.get('partial')
+                    # Même contenu mais découpage différent (--chunk-lines) : le fichier est réémis.
+                    if (comparable and before['sha256'] == digest
+                            and before.get('sections') == manifest_files[relative_path_str].get('sections')):
+                        unchanged += 1
+                        continue
+                    change = 'modified' if before is not None else 'added'
+                    previous_sections = before.get('sections') if comparable else None
+                if sections is None:
+                    records = [file_record(relative_path_str, mode, content, args.encoding, writer.per_file_tokens, change)]
+                else:
+                    records = section_records(relative_path_str, mode, sections, args.encoding, change, previous_sections)
+                for record in records:
+                    writer.add_file(record)
+                # Sans compte par fichier (sortie texte) ou sans tiktoken, le débit en tokens/s
+                # repose sur une estimation, sans seconde tokenisation.
+                exact = all(isinstance(record['tokens'], int) for record in records)
+                progress.update(sum(record['bytes'] for record in records),
+                                sum(record['tokens'] if isinstance(record['tokens'], int) else approximate_tokens(record['content'])
+                                    for record in records),
+                                estimated=not exact)
+        progress.report(final=True)
 
         logging.info("Assemblage du fichier de sortie...")
-        body_content_str = "".join(all_files_content)
-        full_body = project_tree + "\n\n" + "-"*80 + "\nCONTENU DES FICHIERS\n" + "-"*80 + "\n\n" + body_content_str
-        stats = get_file_stats(full_body, args.encoding)
     else:
         # Si on est en mode --tree-only, le corps est juste l'arbre
         logging.info("Mode --tree-only activé : saut de la lecture du contenu des fichiers.")
-        full_body = project_tree
-        stats = "N/A (Mode arbre uniquement)"
 
-    
-    final_output_str = "".join([
-        "Ce fichier est une concaténation de plusieurs fichiers sources d'un projet.\n",
-        f"Date de génération : {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n",
-        f"Statistiques du contenu : {stats}\n\n",
-        full_body
-    ])
-    
+    writer.close(tree_only=args.tree_only)
+    stats = writer.stats
+
+    if not args.dry_run:
+        write_manifest(manifest_path, project_path, output_path.resolve(), tree_entries, manifest_files, transform_params)
+        # En batch, le cache partagé est borné une seule fois, après tous les projets (run_batch).
+        if transform_cache is not None and config_path is not None:
+            prune_transform_cache(transform_cache.directory, config.get('transform_cache_max_mb'))
+    if previous is not None:
+        changed = writer.files
+        logging.info(f"Delta : {changed} fichier(s) ajouté(s) ou modifié(s), {len(deleted_files)} supprimé(s), {unchanged} inchangé(s).")
+        print(f"Delta depuis '{args.since}' : {changed} fichier(s) ajouté(s) ou modifié(s), "
+              f"{len(deleted_files)} supprimé(s), {unchanged} inchangé(s) omis.")
+
     if not args.dry_run:
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(output_path, 'w', encoding=args.encoding) as f: f.write(final_output_str)
         print("\nOpération terminée.")
         print(f"Fichier de sortie généré : {output_path.resolve()}")
     else:
         print("\nOpération (dry run) terminée.")
         print(f"Le fichier de sortie aurait été : {output_path.resolve()}")
 
+    if not args.dry_run:
+        print(f"Manifeste généré : {manifest_path.resolve()}")
     print(f"Fichier de log généré : {log_path.resolve()}")
     print(f"Statistiques finales : {stats}")
 
+    return {
+        'output': str(output_path.resolve()),
+        'log': str(log_path.resolve()),
+        'manifest': str(manifest_path.resolve()),
+        'files': writer.files,
+        'bytes': writer.total_bytes,
+        'tokens': writer.total_tokens,
+        'stats': stats,
+    }
+
+# --- Mode batch (plusieurs projets) ---
+
+def load_batch_jobs(args):
+    """
+    Lit le manifeste de batch : une liste de projets (chemin seul, ou dictionnaire avec
+    'project_path', un 'name' optionnel et toute clé de configuration), éventuellement
+    sous une clé 'projects'. Chaque entrée est fusionnée sur DEFAULT_CONFIG (et sur le
+    fichier passé par -c, s'il y en a un). Retourne [(nom, args, config)].
+    """
+    manifest_path = Path(args.batch)
+    try:
+        with open(manifest_path, 'r', encoding=args.encoding) as f:
+            manifest = yaml.safe_load(f) or []
+    except (OSError, yaml.YAMLError) as e:
+        sys.exit(f"ERREUR: Impossible de lire le manifeste '{manifest_path}': {e}")
+    projects = manifest.get('projects') if isinstance(manifest, dict) else manifest
+    if not isinstance(projects, list):
+        sys.exit(f"ERREUR: Le manifeste '{manifest_path}' doit contenir une liste de projets.")
+
+    base_config = DEFAULT_CONFIG.copy()
+    if args.config:
+        base_config, _ = load_config(args)
+    output_dir = Path(args.output or './build/batch')
+
+    jobs, names = [], set()
+    for item in projects:
+        if isinstance(item, str):
+            item = {'project_path': item}
+        if not isinstance(item, dict) or not item.get('project_path'):
+            sys.exit(f"ERREUR: Entrée de manifeste invalide (clé 'project_path' manquante) : {item}")
+        config = {**base_config, **item}
+        # Les chemins relatifs du manifeste sont relatifs au manifeste lui-même.
+        project_path = (manifest_path.parent / item['project_path']).resolve()
+        name = base_name = str(item.get('name') or project_path.name)
+        suffix = 2
+        while name in names:
+            name = f"{base_name}_{suffix}"
+            suffix += 1
+        names.add(name)
+        # Un cache commun à tous les projets : index et transformations sont partagés.
+        config.setdefault('cache_dir', str(output_dir / SCAN_CACHE_DIRNAME))
+
+        project_args = argparse.Namespace(**vars(args))
+        project_args.project = str(project_path)
+        project_args.output = item.get('output_path') or str(output_dir / name / Path(config['output_path']).name)
+        project_args.batch = None
+        # Les processus du pool sont démoniques et ne peuvent pas créer leur propre pool.
+        project_args.jobs = 1
+        jobs.append((name, project_args, config))
+    return jobs
+
+def run_batch_project(name, args, config):
+    """Traite un projet du batch dans un processus de travail ; les erreurs sont rapportées, pas propagées."""
+    started = time.perf_counter()
+    result = {'name': name, 'project': args.project, 'status': 'ok'}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result.update(run_project(args, config))
+    except SystemExit as e:
+        result['status'] = f"erreur: {e}"
+    except Exception as e:
+        result['status'] = f"erreur: {e!r}"
+    finally:
+        stop_logging()
+    result['duration'] = round(time.perf_counter() - started, 3)
+    return result
+
+def run_batch(args):
+    jobs = load_batch_jobs(args)
+    workers = args.jobs or os.cpu_count() or 1
+    output_dir = Path(args.output or './build/batch')
+    print(f"Batch : {len(jobs)} projet(s) répartis sur {workers} processus...")
+
+    started = time.perf_counter()
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_batch_project, name, project_args, config): name for name, project_args, config in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results[result['name']] = result
+            print(f"  [{len(results)}/{len(jobs)}] {result['name']} : {result['status']} ({result['duration']:.2f} s)")
+
+    ordered = [results[name] for name, _, _ in jobs]
+
+    if not args.dry_run and not args.no_transform_cache:
+        limits = {}
+        for _, _, config in jobs:
+            limits.setdefault(Path(config['cache_dir']) / 'transforms', config.get('transform_cache_max_mb'))
+        for directory, max_mb in limits.items():
+            removed, freed = prune_transform_cache(directory, max_mb)
+            if removed:
+                print(f"Cache de transformations {directory} : {removed} entrée(s) supprimée(s) ({format_bytes(freed)}).")
+    summary = {
+        'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'manifest': str(Path(args.batch).resolve()),
+        'workers': workers,
+        'duration': round(time.perf_counter() - started, 3),
+        'projects': ordered,
+    }
+
+    print("\nRésumé du batch :")
+    for result in ordered:
+        if result['status'] == 'ok':
+            print(f"  {result['name']:<30} {result['files']:>6} fichiers  {format_bytes(result['bytes']):>10}  "
+                  f"{result['tokens']} tokens  {result['duration']:.2f} s")
+        else:
+            print(f"  {result['name']:<30} {result['status']}")
+    print(f"Durée totale : {summary['duration']:.2f} s")
+
+    if not args.dry_run:
+        suffix = "" if args.no_timestamp else "_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        report_path = output_dir / f"batch_summary{suffix}.json"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"Rapport de batch généré : {report_path.resolve()}")
+    return summary
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+
+    if args.compress == 'zstd' and not ZSTD_AVAILABLE:
+        sys.exit("ERREUR: La compression zstd nécessite le paquet 'zstandard' (pip install zstandard).")
+
+    if args.batch:
+        return run_batch(args)
+    config, config_path = load_config(args)
+    try:
+        return run_project(args, config, config_path)
+    finally:
+        stop_logging()
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
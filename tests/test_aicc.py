@@ -91,4 +91,442 @@ def test_basic_concatenation(tmp_path):
     assert output_file.exists(), "Le fichier de sortie n'a pas été créé."
     
     # 5. Comparer le contenu du fichier généré avec le fichier attendu
-    compare_files_robust(output_file, expected_file)
\ No newline at end of file
+    compare_files_robust(output_file, expected_file)
+
+def test_jsonl_gzip_output(tmp_path):
+    """
+    Teste la sortie JSONL compressée : un enregistrement par fichier,
+    encadré par l'arbre et le résumé.
+    """
+    import gzip
+    import json
+
+    test_project_path = TESTS_DIR / 'test_projects' / 'basic_project'
+    output_file = tmp_path / 'output.txt'
+
+    args = [
+        '--project', str(test_project_path),
+        '--output', str(output_file),
+        '--no-timestamp',
+        '--config', str(test_project_path / 'config.yaml'),
+        '--format', 'jsonl',
+        '--compress', 'gzip'
+    ]
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Le script a échoué avec le code {result.returncode}.\nStderr: {result.stderr}"
+
+    compressed_file = tmp_path / 'output.jsonl.gz'
+    assert compressed_file.exists(), "Le fichier de sortie compressé n'a pas été créé."
+    with gzip.open(compressed_file, 'rt', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+
+    assert records[0]['type'] == 'tree'
+    assert records[-1]['type'] == 'summary'
+    files = {r['path']: r for r in records if r['type'] == 'file'}
+    assert sorted(files) == ['.gitignore', 'app/main.py', 'config.yaml', 'utils.py']
+    assert files['utils.py']['mode'] == 'full'
+    assert files['utils.py']['content'] == (test_project_path / 'utils.py').read_text(encoding='utf-8')
+    assert records[-1]['files'] == 4
+    assert records[-1]['bytes'] == sum(r['bytes'] for r in files.values())
+
+
+def test_scan_index_reuse_and_invalidation(tmp_path):
+    """
+    Teste l'index de scan persistant : il est créé au premier passage,
+    réutilisé ensuite, et un fichier ajouté invalide le dossier concerné.
+    """
+    import os
+    import shutil
+    import time
+
+    project_path = tmp_path / 'project'
+    shutil.copytree(TESTS_DIR / 'test_projects' / 'basic_project', project_path)
+    # Vieillir les dossiers pour sortir de la fenêtre de mtime « instable » de l'index.
+    old = time.time() - 60
+    for directory in (project_path, project_path / 'app'):
+        os.utime(directory, (old, old))
+
+    output_file = tmp_path / 'out' / 'output.txt'
+    args = [
+        '--project', str(project_path),
+        '--output', str(output_file),
+        '--no-timestamp',
+        '--config', str(project_path / 'config.yaml')
+    ]
+
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    assert list((tmp_path / 'out' / '.aicc_cache').glob('scan_*.json')), "L'index de scan n'a pas été persisté."
+    first_output = output_file.read_text(encoding='utf-8')
+
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    assert "0 dossier(s) relisté(s)" in (tmp_path / 'out' / 'output.log').read_text(encoding='utf-8')
+    assert output_file.read_text(encoding='utf-8').splitlines()[3:] == first_output.splitlines()[3:]
+
+    (project_path / 'app' / 'extra.py').write_text("VALUE = 1\n", encoding='utf-8')
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    assert "--- FICHIER: app/extra.py" in output_file.read_text(encoding='utf-8')
+
+
+def test_query_selects_relevant_files(tmp_path):
+    """
+    Teste le mode --query : seuls les fichiers pertinents sont retenus,
+    classés par pertinence, et l'index lexical est mis en cache.
+    """
+    import json
+
+    test_project_path = TESTS_DIR / 'test_projects' / 'basic_project'
+    output_file = tmp_path / 'output.jsonl'
+
+    args = [
+        '--project', str(test_project_path),
+        '--output', str(output_file),
+        '--no-timestamp',
+        '--config', str(test_project_path / 'config.yaml'),
+        '--format', 'jsonl',
+        '--query', 'helper function'
+    ]
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Le script a échoué avec le code {result.returncode}.\nStderr: {result.stderr}"
+    assert list((tmp_path / '.aicc_cache').glob('lexical_*.json')), "L'index lexical n'a pas été mis en cache."
+
+    with open(output_file, 'r', encoding='utf-8') as f:
+        files = [json.loads(line) for line in f if '"type": "file"' in line]
+    paths = [r['path'] for r in files]
+    assert paths[0] == 'utils.py'
+    assert 'config.yaml' not in paths
+    assert files[0]['mode'] == 'full'
+
+
+def test_entry_follows_local_imports(tmp_path):
+    """
+    Teste le mode --entry : seuls le module d'entrée et les modules locaux
+    qu'il importe sont inclus ; au-delà des dépendances directes, seuls les en-têtes.
+    """
+    import json
+
+    project_path = tmp_path / 'project'
+    (project_path / 'pkg').mkdir(parents=True)
+    (project_path / 'main.py').write_text("import os\nfrom pkg import core\n", encoding='utf-8')
+    (project_path / 'pkg' / '__init__.py').write_text("", encoding='utf-8')
+    (project_path / 'pkg' / 'core.py').write_text("from .deep import helper\n\nVALUE = helper()\n", encoding='utf-8')
+    (project_path / 'pkg' / 'deep.py').write_text("def helper():\n    return 42\n", encoding='utf-8')
+    (project_path / 'unused.py').write_text("print('jamais importé')\n", encoding='utf-8')
+    output_file = tmp_path / 'output.jsonl'
+
+    args = [
+        '--project', str(project_path),
+        '--output', str(output_file),
+        '--no-timestamp',
+        '--config', str(TESTS_DIR / 'test_projects' / 'basic_project' / 'config.yaml'),
+        '--format', 'jsonl',
+        '--entry', 'main.py',
+        '--depth', '2'
+    ]
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Le script a échoué avec le code {result.returncode}.\nStderr: {result.stderr}"
+
+    with open(output_file, 'r', encoding='utf-8') as f:
+        files = {r['path']: r for r in map(json.loads, f) if r['type'] == 'file'}
+    assert sorted(files) == ['main.py', 'pkg/__init__.py', 'pkg/core.py', 'pkg/deep.py']
+    assert files['pkg/core.py']['mode'] == 'full'
+    assert files['pkg/deep.py']['mode'] == 'headers'
+    assert "return 42" not in files['pkg/deep.py']['content']
+
+    # Un module d'entrée hors du projet est refusé proprement, sans trace d'exception.
+    outside = tmp_path / 'outside.py'
+    outside.write_text("import os\n", encoding='utf-8')
+    result = run_aicc(args[:-4] + ['--entry', str(outside)])
+    assert result.returncode != 0
+    assert "n'est pas situé dans le projet" in result.stderr and "Traceback" not in result.stderr
+
+
+def test_batch_manifest(tmp_path):
+    """
+    Teste le mode --batch : chaque projet du manifeste produit sa propre sortie,
+    avec ses surcharges de configuration, et un rapport de synthèse est écrit.
+    """
+    import json
+
+    projects_dir = TESTS_DIR / 'test_projects'
+    manifest = tmp_path / 'manifest.yaml'
+    manifest.write_text(
+        "- project_path: {basic}\n"
+        "  common_filters: ['.git/', 'expected_output.txt', 'config.yaml']\n"
+        "- {strip}\n"
+        "- project_path: {missing}\n".format(
+            basic=projects_dir / 'basic_project',
+            strip=projects_dir / 'strip_comments_project',
+            missing=tmp_path / 'missing'),
+        encoding='utf-8')
+    output_dir = tmp_path / 'out'
+
+    result = run_aicc(['--batch', str(manifest), '--output', str(output_dir), '--no-timestamp', '--jobs', '2'])
+    assert result.returncode == 0, f"Le script a échoué avec le code {result.returncode}.\nStderr: {result.stderr}"
+
+    with open(output_dir / 'batch_summary.json', 'r', encoding='utf-8') as f:
+        summary = json.load(f)
+    results = {r['name']: r for r in summary['projects']}
+    assert [r['name'] for r in summary['projects']] == ['basic_project', 'strip_comments_project', 'missing']
+    assert results['basic_project']['status'] == 'ok'
+    assert results['basic_project']['files'] == 3
+    assert results['strip_comments_project']['status'] == 'ok'
+    assert results['missing']['status'].startswith('erreur')
+
+    basic_output = (output_dir / 'basic_project' / 'project_context.txt').read_text(encoding='utf-8')
+    assert "--- FICHIER: utils.py" in basic_output
+    assert "--- FICHIER: config.yaml" not in basic_output
+    assert (output_dir / 'strip_comments_project' / 'project_context.txt').exists()
+
+
+def test_log_aggregates_per_file_events(tmp_path):
+    """
+    Teste le logging : sans --verbose, pas de ligne par fichier mais un résumé
+    de progression ; avec --verbose, le détail par fichier est journalisé.
+    """
+    test_project_path = TESTS_DIR / 'test_projects' / 'basic_project'
+    base_args = [
+        '--project', str(test_project_path),
+        '--no-timestamp',
+        '--config', str(test_project_path / 'config.yaml')
+    ]
+
+    result = run_aicc(base_args + ['--output', str(tmp_path / 'quiet.txt')])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    log = (tmp_path / 'quiet.log').read_text(encoding='utf-8')
+    assert "[INCLUS]" not in log
+    assert "Traitement de :" not in log
+    assert "Traitement terminé : 4/4 fichiers" in log
+    # Le débit en tokens figure aussi en sortie texte (estimé si tiktoken est indisponible).
+    assert "tokens/s)" in log.split("Traitement terminé :", 1)[1].splitlines()[0]
+
+    result = run_aicc(base_args + ['--output', str(tmp_path / 'verbose.txt'), '--verbose'])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    log = (tmp_path / 'verbose.log').read_text(encoding='utf-8')
+    assert "[INCLUS] utils.py" in log
+    assert "Traitement de : utils.py" in log
+
+
+def test_plan_estimates_without_output(tmp_path):
+    """
+    Teste le mode --plan : un rapport d'estimation est écrit à partir des
+    métadonnées des fichiers, sans générer le fichier de contexte.
+    """
+    import json
+
+    test_project_path = TESTS_DIR / 'test_projects' / 'basic_project'
+    output_file = tmp_path / 'output.txt'
+    args = [
+        '--project', str(test_project_path),
+        '--output', str(output_file),
+        '--no-timestamp',
+        '--config', str(test_project_path / 'config.yaml'),
+        '--plan'
+    ]
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Le script a échoué avec le code {result.returncode}.\nStderr: {result.stderr}"
+    assert not output_file.exists(), "Le mode --plan ne doit pas générer le fichier de contexte."
+
+    with open(tmp_path / 'output.plan.json', 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    sizes = {p: (test_project_path / p).stat().st_size for p in ['.gitignore', 'app/main.py', 'config.yaml', 'utils.py']}
+    assert [f['path'] for f in plan['files']] == list(sizes)
+    assert plan['total_bytes'] == sum(sizes.values())
+    assert plan['estimated_tokens'] > 0
+    directories = {d['path']: d for d in plan['directories']}
+    assert directories['app']['bytes'] == sizes['app/main.py']
+    assert directories['.']['files'] == 4
+
+    result = run_aicc(args + ['--sample', '1'])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    with open(tmp_path / 'output.plan.json', 'r', encoding='utf-8') as f:
+        assert json.load(f)['sampled_files'] == 4
+
+
+def test_since_emits_only_changes(tmp_path):
+    """
+    Teste la sortie différentielle : un manifeste accompagne chaque sortie, et
+    --since n'émet que les fichiers ajoutés ou modifiés ainsi que les suppressions.
+    """
+    import json
+    import shutil
+
+    project_path = tmp_path / 'project'
+    shutil.copytree(TESTS_DIR / 'test_projects' / 'basic_project', project_path)
+    base_args = [
+        '--project', str(project_path),
+        '--no-timestamp',
+        '--config', str(project_path / 'config.yaml')
+    ]
+
+    result = run_aicc(base_args + ['--output', str(tmp_path / 'first.txt')])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    manifest_path = tmp_path / 'first.manifest.json'
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert sorted(manifest['files']) == ['.gitignore', 'app/main.py', 'config.yaml', 'utils.py']
+    assert 'app/' in manifest['tree']
+
+    with open(project_path / 'utils.py', 'a', encoding='utf-8') as f:
+        f.write("\ndef other():\n    pass\n")
+    (project_path / 'app' / 'extra.py').write_text("VALUE = 1\n", encoding='utf-8')
+    (project_path / '.gitignore').unlink()
+
+    result = run_aicc(base_args + ['--output', str(tmp_path / 'delta.jsonl'), '--format', 'jsonl', '--since', str(manifest_path)])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    with open(tmp_path / 'delta.jsonl', 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    changes = {r['path']: r['change'] for r in records if r['type'] == 'file'}
+    assert changes == {'app/extra.py': 'added', 'utils.py': 'modified'}
+    tree = records[0]['tree']
+    assert "+ app/extra.py" in tree
+    assert "Fichiers supprimés depuis le contexte précédent :\n- .gitignore" in tree
+    assert records[0]['deleted'] == ['.gitignore']
+
+    # Les fichiers existants non retenus par --query ne sont pas signalés comme supprimés.
+    result = run_aicc(base_args + ['--output', str(tmp_path / 'query.jsonl'), '--format', 'jsonl',
+                                   '--since', str(manifest_path), '--query', 'other'])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    with open(tmp_path / 'query.jsonl', 'r', encoding='utf-8') as f:
+        tree_record = json.loads(f.readline())
+    assert tree_record['tree'].endswith("Fichiers supprimés depuis le contexte précédent :\n- .gitignore")
+    assert tree_record['deleted'] == ['.gitignore']
+
+
+def test_chunk_lines_splits_large_python_files(tmp_path):
+    """
+    Teste le découpage par symboles : un gros fichier Python est émis en sections
+    (une par classe, méthode et fonction), et --since n'émet que les sections modifiées.
+    """
+    import json
+
+    project_path = tmp_path / 'project'
+    project_path.mkdir()
+    functions = "".join(f"\n\ndef function_{i}():\n    return {i}\n" for i in range(20))
+    source = f"import os\n\n\nclass Engine:\n    def start(self):\n        pass\n\n    def stop(self):\n        pass\n{functions}"
+    (project_path / 'big.py').write_text(source, encoding='utf-8')
+    (project_path / 'small.py').write_text("def tiny():\n    pass\n", encoding='utf-8')
+    base_args = ['--project', str(project_path), '--no-timestamp', '--format', 'jsonl', '--chunk-lines', '50']
+
+    result = run_aicc(base_args + ['--output', str(tmp_path / 'first.jsonl')])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    with open(tmp_path / 'first.jsonl', 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    sections = [r for r in records if r['type'] == 'file' and r['path'] == 'big.py']
+    assert [r['symbol'] for r in sections[:4]] == ['<module>', 'Engine', 'Engine.start', 'Engine.stop']
+    assert len(sections) == 24
+    assert "".join(r['content'] for r in sections) == source
+    assert all('tokens' in r and r['lines'][0] <= r['lines'][1] for r in sections)
+    assert 'symbol' not in next(r for r in records if r.get('path') == 'small.py')
+    assert records[-1]['files'] == 2
+
+    (project_path / 'big.py').write_text(source.replace("return 7", "return 70"), encoding='utf-8')
+    result = run_aicc(base_args + ['--output', str(tmp_path / 'delta.jsonl'), '--since', str(tmp_path / 'first.manifest.json')])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    with open(tmp_path / 'delta.jsonl', 'r', encoding='utf-8') as f:
+        changed = [(r['symbol'], r['change']) for r in map(json.loads, f) if r['type'] == 'file']
+    assert changed == [('function_7', 'modified')]
+
+    # Sans découpage, le même contenu est émis autrement : le fichier est réémis en entier.
+    no_chunk_args = [a for a in base_args if a not in ('--chunk-lines', '50')]
+    result = run_aicc(no_chunk_args + ['--output', str(tmp_path / 'whole.jsonl'), '--since', str(tmp_path / 'delta.manifest.json')])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    with open(tmp_path / 'whole.jsonl', 'r', encoding='utf-8') as f:
+        changed = [(r['path'], r.get('symbol'), r['change']) for r in map(json.loads, f) if r['type'] == 'file']
+    assert changed == [('big.py', None, 'modified')]
+
+    # Un fichier d'exactement --chunk-lines lignes n'est pas découpé.
+    exact_args = no_chunk_args + ['--chunk-lines', str(len(source.splitlines()))]
+    result = run_aicc(exact_args + ['--output', str(tmp_path / 'exact.jsonl')])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    with open(tmp_path / 'exact.jsonl', 'r', encoding='utf-8') as f:
+        assert all('symbol' not in r for r in map(json.loads, f) if r['type'] == 'file')
+
+    # Fichier émis partiellement par --query : un --since sans requête le réémet en entier.
+    needle_source = source.replace("return 3\n", "return 3  # needle\n")
+    (project_path / 'big.py').write_text(needle_source, encoding='utf-8')
+    small_args = no_chunk_args + ['--chunk-lines', '10']
+    result = run_aicc(small_args + ['--output', str(tmp_path / 'needle.jsonl'), '--query', 'needle', '--token-budget', '60'])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    with open(tmp_path / 'needle.jsonl', 'r', encoding='utf-8') as f:
+        assert [r.get('symbol') for r in map(json.loads, f) if r.get('path') == 'big.py'] == ['function_3']
+    result = run_aicc(small_args + ['--output', str(tmp_path / 'after.jsonl'), '--since', str(tmp_path / 'needle.manifest.json')])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    with open(tmp_path / 'after.jsonl', 'r', encoding='utf-8') as f:
+        big = [r for r in map(json.loads, f) if r['type'] == 'file' and r['path'] == 'big.py']
+    assert "".join(r['content'] for r in big) == needle_source
+    assert {r['change'] for r in big} == {'modified'}
+
+
+def test_transform_cache_is_bounded_and_untouched_by_dry_run(tmp_path):
+    """
+    Teste le cache de transformations : rien n'est écrit en --dry-run, les entrées
+    les moins récemment utilisées sont supprimées au-delà de transform_cache_max_mb,
+    et un run sans nouvelle entrée ne rafraîchit ni n'élague le cache.
+    """
+    import os
+    import time
+
+    import yaml
+
+    project_path = tmp_path / 'project'
+    project_path.mkdir()
+    for i in range(5):
+        (project_path / f"module_{i}.py").write_text(f"# commentaire\nVALUE = {i}\n", encoding='utf-8')
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(yaml.safe_dump({'transform_cache_max_mb': 0}), encoding='utf-8')
+    cache_dir = tmp_path / 'out' / '.aicc_cache' / 'transforms'
+    args = ['--project', str(project_path), '--output', str(tmp_path / 'out' / 'ctx.txt'), '--no-timestamp',
+            '--config', str(config_path), '--strip-comments']
+
+    result = run_aicc(args + ['--dry-run'])
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    assert not cache_dir.exists()
+
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    assert [p for p in cache_dir.rglob('*') if p.is_file()] == []
+    with open(tmp_path / 'out' / 'ctx.log', 'r', encoding='utf-8') as f:
+        assert "5 entrée(s) ancienne(s) supprimée(s)" in f.read()
+
+    # Run chaud : les entrées lues récemment gardent leur mtime, et sans écriture
+    # le cache n'est pas élagué, même au-delà de la limite.
+    config_path.write_text(yaml.safe_dump({'transform_cache_max_mb': 1}), encoding='utf-8')
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    entries = [p for p in cache_dir.rglob('*') if p.is_file()]
+    assert len(entries) == 5
+    recent = time.time() - 3600
+    for entry in entries:
+        os.utime(entry, (recent, recent))
+    config_path.write_text(yaml.safe_dump({'transform_cache_max_mb': 0}), encoding='utf-8')
+    result = run_aicc(args)
+    assert result.returncode == 0, f"Stderr: {result.stderr}"
+    assert sorted(p.stat().st_mtime for p in cache_dir.rglob('*') if p.is_file()) == [recent] * 5
+
+
+def test_unwritable_cache_dir_does_not_abort(tmp_path):
+    """
+    Teste la robustesse des caches : un dossier de cache impossible à créer
+    (ici sous un fichier) est signalé par un avertissement, la sortie est produite.
+    """
+    import yaml
+
+    test_project_path = TESTS_DIR / 'test_projects' / 'basic_project'
+    blocker = tmp_path / 'blocker'
+    blocker.write_text("", encoding='utf-8')
+    config = yaml.safe_load((test_project_path / 'config.yaml').read_text(encoding='utf-8'))
+    config['cache_dir'] = str(blocker / 'cache')
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(yaml.safe_dump(config), encoding='utf-8')
+    base_args = ['--project', str(test_project_path), '--no-timestamp', '--config', str(config_path)]
+
+    for name, extra in [('scan', []), ('query', ['--query', 'main']), ('entry', ['--entry', 'utils.py'])]:
+        output_file = tmp_path / f"{name}.txt"
+        result = run_aicc(base_args + ['--output', str(output_file)] + extra)
+        assert result.returncode == 0, f"{name} : {result.stderr}"
+        assert "Traceback" not in result.stderr
+        assert "AVERTISSEMENT: Index de cache" in result.stderr
+        assert output_file.exists()
@@ -0,0 +1,333 @@
+# tests/test_pipeline.py
+
+"""
+Tests en processus (aicc.main et fonctions du pipeline) sur des arborescences générées :
+milliers de fichiers, imbrication profonde, noms unicode, boucles de liens symboliques,
+fichiers binaires, liens physiques et FIFO (liens symboliques et FIFO seulement si la
+plateforme les permet). Vérifie l'équivalence des sorties entre les modes séquentiel,
+parallèle, avec caches et en flux, et compare le scan et les transformations à une
+référence de performance enregistrée (perf_baseline.json).
+
+Variables d'environnement :
+  AICC_FIXTURE_FILES=N       taille de l'arborescence générée (défaut: 3000 fichiers).
+  AICC_UPDATE_BASELINE=1     réenregistre la référence de performance au lieu de la vérifier.
+"""
+
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pathspec
+import pytest
+
+TESTS_DIR = Path(__file__).parent
+PROJECT_ROOT = TESTS_DIR.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import aicc  # noqa: E402
+
+FIXTURE_FILES = int(os.environ.get('AICC_FIXTURE_FILES', 3000))
+BASELINE_PATH = TESTS_DIR / 'perf_baseline.json'
+# Marge tolérée par rapport à la référence (les machines d'intégration sont bruitées).
+PERF_TOLERANCE = 3.0
+# Marge élargie si la référence a été enregistrée avec une autre version de Python
+# (ast, re et le ramasse-miettes n'y ont pas les mêmes performances).
+PERF_TOLERANCE_OTHER_PYTHON = 6.0
+DEEP_LEVELS = 40
+UNICODE_NAMES = ['données/été.py', '文档/说明.txt', 'emoji_🚀.py', 'Ärger/ñandú.js']
+
+def symlinks_supported():
+    """Sous Windows, créer un lien symbolique demande le mode développeur ou des droits d'administrateur."""
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            os.symlink(directory, Path(directory) / 'link')
+        except (OSError, NotImplementedError, AttributeError):
+            return False
+    return True
+
+SYMLINKS = symlinks_supported()
+HAS_FIFO = hasattr(os, 'mkfifo')
+requires_symlinks = pytest.mark.skipif(not SYMLINKS, reason="liens symboliques non pris en charge sur cette plateforme")
+
+# --- Génération de l'arborescence ---
+
+def python_module(rng, index):
+    functions = "".join(
+        f"\n\n# Fonction {i} du module {index}\ndef compute_{index}_{i}(value):\n"
+        f"    \"\"\"Calcule la valeur {i}.\"\"\"\n    return value * {rng.randint(1, 99)}  # facteur\n"
+        for i in range(rng.randint(1, 6))
+    )
+    return (f"\"\"\"Module généré {index}.\"\"\"\nimport os\n\n\nclass Model{index}:\n"
+            f"    \"\"\"Modèle {index}.\"\"\"\n\n    def run(self):\n        # exécution\n        return os.sep\n{functions}")
+
+def build_fixture_tree(root, n_files, seed=0):
+    """Crée une arborescence déterministe de `n_files` fichiers (environ) sous `root`."""
+    rng = random.Random(seed)
+    root.mkdir(parents=True)
+    for index in range(n_files):
+        package = root / f"pkg_{index % 25:02d}" / f"sub_{index % 7}"
+        package.mkdir(parents=True, exist_ok=True)
+        kind = index % 10
+        if kind < 6:
+            (package / f"module_{index}.py").write_text(python_module(rng, index), encoding='utf-8')
+        elif kind < 8:
+            (package / f"script_{index}.js").write_text(f"// script {index}\nfunction f{index}() {{ return {index}; }}\n", encoding='utf-8')
+        elif kind == 8:
+            (package / f"notes_{index}.md").write_text(f"# Notes {index}\n\n{'texte ' * rng.randint(1, 50)}\n", encoding='utf-8')
+        else:
+            (package / f"blob_{index}.bin").write_bytes(bytes(rng.randrange(256) for _ in range(rng.randint(1, 512))) + b"\x00")
+
+    deep = root.joinpath(*(f"level_{i}" for i in range(DEEP_LEVELS)))
+    deep.mkdir(parents=True)
+    (deep / 'bottom.py').write_text("def bottom():\n    return 'deep'\n", encoding='utf-8')
+
+    for name in UNICODE_NAMES:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"# {name}\nVALUE = '{name}'\n", encoding='utf-8')
+
+    loop = root / 'loop' / 'inner'
+    loop.mkdir(parents=True)
+    (loop / 'data.py').write_text("LOOP = True\n", encoding='utf-8')
+    os.link(root / 'pkg_01' / 'sub_1' / 'module_1.py', root / 'hardlinked_module.py')
+    if SYMLINKS:
+        # Boucles de liens symboliques, lien vers un fichier et lien cassé.
+        os.symlink('..', loop / 'back_to_loop')
+        os.symlink(root, root / 'loop' / 'to_root')
+        os.symlink(Path('pkg_00') / 'sub_0' / 'module_0.py', root / 'linked_module.py')
+        os.symlink('does_not_exist.py', root / 'dangling.py')
+        # Dossier partagé hors du projet (cache, checkout voisin).
+        shared = root.parent / 'shared_checkout'
+        shared.mkdir()
+        (shared / 'vendored.py').write_text("VENDORED = True\n", encoding='utf-8')
+        os.symlink(shared, root / 'vendor_link')
+    if HAS_FIFO:
+        # Ouvrir la FIFO bloquerait indéfiniment la lecture.
+        os.mkfifo(root / 'pipe.fifo')
+
+    # Dossiers exclus par les filtres par défaut.
+    for excluded in ('node_modules/lib', '__pycache__', 'build'):
+        (root / excluded).mkdir(parents=True, exist_ok=True)
+        (root / excluded / 'ignored.js').write_text("ignored();\n", encoding='utf-8')
+
+@pytest.fixture(scope='module')
+def generated_project(tmp_path_factory):
+    base = tmp_path_factory.mktemp('pipeline')
+    project = base / 'project'
+    build_fixture_tree(project, FIXTURE_FILES)
+    config = base / 'config.yaml'
+    config.write_text(json.dumps({**aicc.DEFAULT_CONFIG, 'tree_only_filters': ['*.md']}), encoding='utf-8')
+    return project, config
+
+def run_main(project, config, output, *extra):
+    """Exécute aicc en processus ; retourne le résumé de run_project."""
+    return aicc.main(['-p', str(project), '-c', str(config), '-o', str(output), '--no-timestamp', *extra])
+
+def read_body(path):
+    """Sortie texte sans la ligne de date de génération, seule partie variable."""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines(keepends=True)
+    return "".join(line for i, line in enumerate(lines) if i != 1)
+
+def text_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        body = f.read().split("\nCONTENU DES FICHIERS\n" + "-" * 80 + "\n\n", 1)[1]
+    parts = re.split(r"\n={80}\n--- FICHIER: (.*)\n={80}\n\n", body)
+    return dict(zip(parts[1::2], parts[2::2]))
+
+def jsonl_records(path, opener=open):
+    with opener(path, 'rt', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    return records
+
+# --- Équivalence des modes ---
+
+def test_sequential_parallel_and_cached_outputs_match(generated_project, tmp_path):
+    project, config = generated_project
+    reference = run_main(project, config, tmp_path / 'ref' / 'ctx.txt', '--strip-comments', '--no-scan-cache', '--no-transform-cache')
+    assert reference['files'] >= FIXTURE_FILES * 0.9
+    expected = read_body(reference['output'])
+
+    parallel = run_main(project, config, tmp_path / 'par' / 'ctx.txt', '--strip-comments', '--no-scan-cache', '-j', '4')
+    assert read_body(parallel['output']) == expected
+
+    # Premier passage : les caches (scan, transformations) sont remplis ; second : ils sont relus.
+    for attempt in ('cold', 'warm'):
+        cached = run_main(project, config, tmp_path / 'cache' / 'ctx.txt', '--strip-comments')
+        assert read_body(cached['output']) == expected, attempt
+    with open(cached['log'], 'r', encoding='utf-8') as f:
+        assert "Index de scan : 0 dossier(s) relisté(s)" in f.read()
+    assert any((tmp_path / 'cache' / '.aicc_cache' / 'transforms').iterdir())
+
+def test_streaming_formats_match_text(generated_project, tmp_path):
+    project, config = generated_project
+    text = text_records(run_main(project, config, tmp_path / 'ctx.txt')['output'])
+    assert len(text) >= FIXTURE_FILES * 0.9
+
+    records = jsonl_records(run_main(project, config, tmp_path / 'ctx.jsonl', '--format', 'jsonl', '--compress', 'gzip', '-j', '2')['output'], gzip.open)
+    assert records[0]['type'] == 'tree' and records[-1]['type'] == 'summary'
+    assert {r['path']: r['content'] for r in records if r['type'] == 'file'} == text
+    assert records[-1]['files'] == len(text)
+
+    with open(run_main(project, config, tmp_path / 'ctx.md', '--format', 'md')['output'], 'r', encoding='utf-8') as f:
+        markdown = f.read()
+    blocks = re.findall(r"\n### `([^\n]*)`\n\n(`{3,})[^\n]*\n(.*?)\n\2\n", markdown, re.S)
+    assert {path: body for path, _, body in blocks} == {path: content.rstrip('\n') for path, content in text.items()}
+
+def test_text_output_tokenizes_body_once(tmp_path, monkeypatch):
+    """En sortie texte, seul le corps complet est tokenisé ; les formats en flux comptent par fichier."""
+    project = tmp_path / 'project'
+    project.mkdir()
+    for index in range(5):
+        (project / f"module_{index}.py").write_text(f"VALUE = {index}\n", encoding='utf-8')
+    config = tmp_path / 'config.yaml'
+    config.write_text(json.dumps(aicc.DEFAULT_CONFIG), encoding='utf-8')
+    calls = []
+    monkeypatch.setattr(aicc, 'count_tokens', lambda content: calls.append(content) or len(content.split()))
+
+    run_main(project, config, tmp_path / 'out' / 'ctx.txt', '--no-scan-cache')
+    assert len(calls) == 1
+    calls.clear()
+    run_main(project, config, tmp_path / 'out' / 'ctx.jsonl', '--no-scan-cache', '--format', 'jsonl')
+    assert len(calls) == 5
+
+def default_tree(project):
+    include_spec = pathspec.PathSpec.from_lines('gitwildmatch', ['**/*'])
+    exclude_spec = pathspec.PathSpec.from_lines('gitwildmatch', aicc.DEFAULT_CONFIG['common_filters'])
+    return aicc.collect_tree_paths(project, include_spec, exclude_spec)
+
+def test_tree_handles_unicode_nesting_and_binaries(generated_project):
+    project, _ = generated_project
+    paths, dirs = default_tree(project)
+
+    assert set(UNICODE_NAMES) <= set(paths)
+    assert "/".join(f"level_{i}" for i in range(DEEP_LEVELS)) + "/bottom.py" in paths
+    assert not any(p.startswith(('node_modules', '__pycache__', 'build')) for p in paths)
+    # Fichiers spéciaux et liens cassés sont écartés dès le scan.
+    assert 'pipe.fifo' not in paths and 'dangling.py' not in paths
+    tree = aicc.render_tree(project, paths, dirs)
+    assert '🚀' in tree and '说明.txt' in tree
+
+    blob = next(p for p in paths if p.endswith('.bin'))
+    content, error = aicc.read_and_transform((blob, 'full'), project, 'utf-8', [])
+    assert error is None and isinstance(content, str)
+    content, error = aicc.read_and_transform(('dangling.py', 'full'), project, 'utf-8', [])
+    assert content is None and error
+
+@requires_symlinks
+def test_tree_shows_directory_links_without_walking_them(generated_project):
+    project, _ = generated_project
+    paths, dirs = default_tree(project)
+    # Les liens vers des dossiers sont affichés sans être parcourus : pas de boucle.
+    assert {'loop/to_root', 'loop/inner/back_to_loop', 'vendor_link'} <= dirs
+    assert not any(p.startswith(('loop/to_root/', 'loop/inner/back_to_loop/', 'vendor_link/')) for p in paths)
+
+@requires_symlinks
+def test_follow_symlinks_is_loop_safe_and_deduplicates(generated_project, tmp_path):
+    project, _ = generated_project
+    config = tmp_path / 'config.yaml'
+    config.write_text(json.dumps({**aicc.DEFAULT_CONFIG, 'follow_symlinks': True}), encoding='utf-8')
+    summary = run_main(project, config, tmp_path / 'ctx.jsonl', '--format', 'jsonl')
+    paths = [r['path'] for r in jsonl_records(summary['output']) if r['type'] == 'file']
+
+    assert 'vendor_link/vendored.py' in paths
+    # Les boucles (lien vers la racine, vers un ancêtre) ne sont pas reparcourues.
+    assert 'loop/inner/data.py' in paths
+    assert not any(p.startswith(('loop/to_root/', 'loop/inner/back_to_loop/')) for p in paths)
+    assert len(paths) == len(set(paths))
+    # Un fichier lié plusieurs fois n'est émis qu'une fois : sous son chemin réel plutôt
+    # que via un lien symbolique (trié avant lui), sinon sous le premier chemin trié.
+    assert 'pkg_00/sub_0/module_0.py' in paths and 'linked_module.py' not in paths
+    hardlinks = ['hardlinked_module.py', 'pkg_01/sub_1/module_1.py']
+    kept = min(hardlinks, key=aicc.path_sort_key)
+    assert kept in paths and next(p for p in hardlinks if p != kept) not in paths
+    assert 'pipe.fifo' not in paths
+
+    with open(summary['log'], 'r', encoding='utf-8') as f:
+        log = f.read()
+    assert "fichier(s) spécial(aux) ignoré(s)" in log and "2 doublon(s) ignoré(s)" in log
+    assert "Doublon ignoré :" not in log
+
+@requires_symlinks
+def test_follow_symlinks_keeps_real_directory_paths(tmp_path):
+    """Un dossier atteint par son chemin réel et par un lien garde son chemin réel, quel que soit l'ordre de tri."""
+    project = tmp_path / 'project'
+    for name, module in (('a_real', 'first.py'), ('m_real', 'second.py')):
+        (project / name).mkdir(parents=True)
+        (project / name / module).write_text("VALUE = 1\n", encoding='utf-8')
+    os.symlink('a_real', project / 'z_link')  # lien trié après sa cible
+    os.symlink('m_real', project / '0_link')  # lien trié avant sa cible
+    config = tmp_path / 'config.yaml'
+    config.write_text(json.dumps({**aicc.DEFAULT_CONFIG, 'follow_symlinks': True}), encoding='utf-8')
+
+    summary = run_main(project, config, tmp_path / 'out' / 'ctx.jsonl', '--format', 'jsonl')
+    records = jsonl_records(summary['output'])
+    assert [r['path'] for r in records if r['type'] == 'file'] == ['a_real/first.py', 'm_real/second.py']
+    assert "│   └── first.py" in records[0]['tree'] and "│   └── second.py" in records[0]['tree']
+
+# --- Garde-fous de performance ---
+
+def best_of(runs, func):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def calibration_workload():
+    """Charge Python pure et fixe : les mesures lui sont rapportées pour rester comparables d'une machine à l'autre."""
+    total = 0
+    for i in range(300_000):
+        total += len(str(i)) * (i % 7)
+    return total
+
+def test_scan_and_transform_against_baseline(generated_project):
+    project, _ = generated_project
+    include_spec = pathspec.PathSpec.from_lines('gitwildmatch', ['**/*'])
+    exclude_spec = pathspec.PathSpec.from_lines('gitwildmatch', aicc.DEFAULT_CONFIG['common_filters'])
+    sources = []
+    for path in sorted(project.rglob('*.py')):
+        if path.is_file() and 'loop' not in path.parts:
+            sources.append((path, path.read_text(encoding='utf-8')))
+
+    def scan():
+        aicc.collect_tree_paths(project, include_spec, exclude_spec, aicc.ScanIndex())
+        for _ in aicc.walk_filtered(project, include_spec, exclude_spec, 'content', aicc.ScanIndex()):
+            pass
+
+    def transform():
+        for path, content in sources:
+            aicc.transform_content(content, path, 'strip', [])
+            aicc.transform_content(content, path, 'headers', ['main'])
+
+    calibration = best_of(5, calibration_workload)
+    measured = {
+        'scan': best_of(3, scan) / calibration,
+        'transform': best_of(3, transform) / calibration,
+    }
+
+    if os.environ.get('AICC_UPDATE_BASELINE') or not BASELINE_PATH.exists():
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'files': FIXTURE_FILES, 'python': list(sys.version_info[:2]),
+                       'ratios': {name: round(ratio, 3) for name, ratio in measured.items()}}, f, indent=2)
+            f.write("\n")
+        pytest.skip(f"Référence de performance enregistrée dans {BASELINE_PATH}")
+
+    with open(BASELINE_PATH, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['files'] != FIXTURE_FILES:
+        pytest.skip(f"Référence enregistrée pour {baseline['files']} fichiers, arborescence de {FIXTURE_FILES}")
+    same_python = baseline['python'] == list(sys.version_info[:2])
+    tolerance = PERF_TOLERANCE if same_python else PERF_TOLERANCE_OTHER_PYTHON
+    reference = f"référence Python {'.'.join(map(str, baseline['python']))}"
+    for name, ratio in measured.items():
+        limit = baseline['ratios'][name] * tolerance
+        assert ratio <= limit, (f"Régression de performance '{name}' : {ratio:.2f} > {limit:.2f} "
+                                f"({reference} : {baseline['ratios'][name]:.2f}, tolérance x{tolerance})")